@@ -7,13 +7,16 @@
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
 from passlib.context import CryptContext
+from concurrent.futures import Future, ThreadPoolExecutor
+import asyncio
+import functools
+import hashlib
 import os
-from dotenv import load_dotenv
-
-
-# Load environment variables from .env file
-# This is important for keeping sensitive information like secret keys and database URLs out of the codebase.
-load_dotenv()
+import secrets
+import threading
+import time
+from app import config  # noqa: F401  (loads the .env file)
+from app.cache import TTLCache
 
 
 # Environment variables for JWT authentication
@@ -22,21 +25,94 @@ ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 
 
+# Cache of tokens whose signature and claims have already been verified, keyed by the SHA-256 hash of the token.
+# Clients send the same token on every request, so this skips the signature check for all but the first one.
+# Each entry expires together with its token; set TOKEN_CACHE_SIZE to 0 to disable the cache.
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
 # Password hashing context
 # This context is used to hash passwords securely using the bcrypt algorithm.
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# BCRYPT_ROUNDS sets the cost factor (each extra round doubles the hashing time); hashes made with a different
+# cost are flagged by needs_update and transparently rehashed on the next successful login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+# Password hashing runs on a dedicated pool of threads (bcrypt releases the GIL while hashing), so a burst of logins
+# is limited to PASSWORD_HASH_WORKERS cores. At most PASSWORD_HASH_MAX_PENDING more calls can wait for a free thread;
+# beyond that PasswordHasherBusy is raised, which the app turns into a 503 response.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+password_hash_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+password_hash_slots = threading.BoundedSemaphore(
+    PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_PENDING)
+
+
+# An exception raised when the password hashing pool already has as many calls queued as it accepts.
+class PasswordHasherBusy(Exception):
+    pass
+
+
+# A function to run a password hashing call on the password hashing pool.
+# It returns a Future right away, or raises PasswordHasherBusy if the pool is overloaded.
+def submit_password_task(fn, *args) -> Future:
+    if not password_hash_slots.acquire(blocking=False):
+        raise PasswordHasherBusy()
+    try:
+        future = password_hash_executor.submit(fn, *args)
+    except BaseException:
+        password_hash_slots.release()
+        raise
+    future.add_done_callback(lambda _: password_hash_slots.release())
+    return future
 
 
 # A function to hash a password using the bcrypt algorithm.
 # This function takes a plain password as input and returns the hashed password.
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return submit_password_task(pwd_context.hash, password).result()
 
 
 # A function to verify a plain password against a hashed password.
 # This function takes a plain password and a hashed password as input and returns True if they match, False otherwise.
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return submit_password_task(pwd_context.verify, plain_password, hashed_password).result()
+
+
+# A function to verify a plain password and check whether its hash should be upgraded.
+# It returns a tuple of (matches, new_hash), where new_hash is None unless the hash was made with outdated settings.
+def verify_and_update_password(plain_password, hashed_password):
+    return submit_password_task(pwd_context.verify_and_update, plain_password, hashed_password).result()
+
+
+# A function returning the hash checked when a login names a user that does not exist.
+# It is made once, with the current cost, from a random password that no one can know.
+@functools.lru_cache(maxsize=None)
+def dummy_password_hash() -> str:
+    return pwd_context.hash(secrets.token_urlsafe(32))
+
+
+# A function to spend as much time as a real password check, for logins naming a user that does not exist.
+# Without it the response time would reveal which usernames are registered.
+def verify_dummy_password(plain_password):
+    verify_and_update_password(plain_password, dummy_password_hash())
+
+
+# Async versions of the functions above, for the async routes.
+# They wait for the password hashing pool without blocking the event loop.
+async def hash_password_async(password: str) -> str:
+    return await asyncio.wrap_future(submit_password_task(pwd_context.hash, password))
+
+
+async def verify_and_update_password_async(plain_password, hashed_password):
+    return await asyncio.wrap_future(submit_password_task(pwd_context.verify_and_update, plain_password, hashed_password))
+
+
+async def verify_dummy_password_async(plain_password):
+    await verify_and_update_password_async(plain_password, dummy_password_hash())
 
 
 # A function to create a JWT access token.
@@ -49,10 +125,18 @@ def create_access_token(data: dict):
 
 
 # A function to decode a JWT token and retrieve the payload.
-# This function takes a token as input and decodes it using the secret key and algorithm.
+# This function takes a token as input and decodes it using the secret key and algorithm,
+# unless the same token has already been verified and has not expired yet.
 def decode_token(token: str):
+    key = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(key)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except JWTError:
         return None
+    # Tokens without an expiry are never cached
+    if isinstance(payload.get("exp"), (int, float)):
+        token_cache.set(key, payload, ttl=payload["exp"] - time.time())
+    return payload
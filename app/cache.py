@@ -0,0 +1,187 @@
+'''
+In-process caches used to avoid repeating work on every request.
+This module provides a small thread-safe cache with a maximum size (least recently used entries are evicted first)
+and a time-to-live per entry, and keeps hit/miss counters so its effectiveness can be monitored.
+It also provides a cache for serialized responses, which can be kept in-process or shared through Redis.
+'''
+
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+# A class representing a bounded LRU cache whose entries expire after a time-to-live.
+# A maxsize of 0 disables the cache: nothing is stored and every lookup is a miss.
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Returns the cached value for key, or default if it is missing or has expired.
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    # Stores value under key for ttl seconds (the cache default when not given), evicting the least recently used entry if full.
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # Removes key from the cache, if present.
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    # Removes every entry from the cache.
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # Returns the size and hit/miss counters of the cache.
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# A class representing an in-process cache backend for ResponseCache, backed by a TTLCache.
+# Counters are kept apart from the cached values, so they are never evicted.
+class LocalCacheBackend:
+    def __init__(self, maxsize: int, ttl: float):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.entries.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self.entries.set(key, value, ttl=ttl)
+
+    def get_counter(self, key: str) -> int:
+        return self._counters.get(key, 0)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def stats(self) -> dict:
+        return self.entries.stats()
+
+
+# A class representing a cache backend for ResponseCache that stores entries in Redis (or a compatible server),
+# so every worker shares the same entries and sees the same invalidations.
+# It takes any client with the get/set/incr methods of redis-py.
+class RedisCacheBackend:
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self.client.set(key, value, ex=max(1, int(ttl)))
+
+    def get_counter(self, key: str) -> int:
+        return int(self.client.get(key) or 0)
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(key)
+
+    def stats(self) -> dict:
+        return {"backend": "redis"}
+
+
+# A function to create the ResponseCache backend from a URL: an in-process LRU when url is empty, Redis otherwise.
+# The redis package is only needed when a Redis URL is configured.
+def create_cache_backend(url: Optional[str], maxsize: int, ttl: float):
+    if not url:
+        return LocalCacheBackend(maxsize=maxsize, ttl=ttl)
+    import redis
+    return RedisCacheBackend(redis.Redis.from_url(url))
+
+
+# A class representing a cache of serialized responses with an ETag, stored in a pluggable backend.
+# Entries are keyed by a generation number; invalidate() bumps the generation, so all previous entries
+# become unreachable at once (and age out of the backend) without having to find and delete them.
+class ResponseCache:
+    def __init__(self, backend, namespace: str, ttl: float):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+        self._generation_key = f"{namespace}:generation"
+        self._seen_generation = None
+        self._seen_at = 0.0
+
+    # Returns the slot of key in the current generation.
+    # Callers should look a slot up before querying the data and store the result in that same slot,
+    # so data read before a concurrent invalidation is never stored in the new generation.
+    def slot(self, key: str) -> str:
+        generation = self.backend.get_counter(self._generation_key)
+        if generation != self._seen_generation:
+            # Remember when this worker first saw the generation (invalidated here or by another worker)
+            if self._seen_generation is not None:
+                self._seen_at = time.monotonic()
+            self._seen_generation = generation
+        return f"{self.namespace}:{generation}:{key}"
+
+    # Returns True if the cache was invalidated less than `seconds` ago, as far as this worker has seen.
+    # Data read from a lagging replica in that window may predate the invalidation, and should not be cached.
+    def changed_within(self, seconds: float) -> bool:
+        return time.monotonic() - self._seen_at < seconds
+
+    # Returns the cached (etag, body) of a slot, or None on a miss.
+    def get(self, slot: str):
+        value = self.backend.get(slot)
+        if value is None:
+            return None
+        etag, _, body = value.partition(b"\n")
+        return etag.decode(), body
+
+    # Stores body in a slot (unless store is False) and returns it with its ETag.
+    def set(self, slot: str, body: bytes, store: bool = True):
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        if store and self.ttl > 0:
+            self.backend.set(slot, etag.encode() + b"\n" + body, self.ttl)
+        return etag, body
+
+    # Makes every cached entry stale.
+    def invalidate(self):
+        self.backend.incr(self._generation_key)
+
+    def stats(self) -> dict:
+        return {"generation": self.backend.get_counter(self._generation_key), **self.backend.stats()}
@@ -0,0 +1,22 @@
+'''
+Configuration loading.
+Settings are read from environment variables; a .env file, if present, is loaded into the environment once, when this
+module is first imported. Every module reading settings imports it first.
+'''
+
+
+import os
+from dotenv import load_dotenv
+
+
+# Load environment variables from .env file
+# This is important for keeping sensitive information like secret keys and database URLs out of the codebase.
+load_dotenv()
+
+
+# Function to read a boolean flag from an environment variable
+def env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
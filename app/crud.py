@@ -3,10 +3,87 @@ A module for CRUD operations on the database models.
 '''
 
 
+import base64
+import json
+import os
+import random
+import time
+from datetime import datetime, timezone
+from itertools import chain
+from typing import List, Optional
 from fastapi import HTTPException
+from sqlalchemy import and_, case, delete, event, func, insert, or_, update
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select
-from app.models import User, Project, UserCreate, ProjectCreate
-from app.auth import hash_password, verify_password
+from app.models import User, Project, ProjectChange, ProjectFreeId, UserCreate, ProjectCreate, ProjectOperation, PROJECT_NAME_CASE_INSENSITIVE
+from app.auth import hash_password, verify_and_update_password, verify_dummy_password
+from app.cache import ResponseCache, create_cache_backend
+from app.database import sync_project_id_sequence
+from app.search import postgres_search_query, search_index, similarity_threshold_query, tokenize
+
+
+# Columns that can be requested through the `fields` projection of the project listing.
+# The page size bounds keep the work done per list request constant no matter how large the table grows.
+PROJECT_FIELDS = ("id", "name", "description", "version")
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# How new project IDs are assigned: "gap" (the default) reuses the IDs freed by deletions, lowest first, and lets the
+# database assign the next ID when there is none; "sequence" always lets the database assign them.
+# Freed IDs are kept in the ProjectFreeId table, so reusing one costs an index lookup whatever the size of the table.
+# Inserts that collide on the primary key are retried a few times before giving up.
+PROJECT_ID_STRATEGY = os.getenv("PROJECT_ID_STRATEGY", "gap")
+PROJECT_ID_RETRIES = int(os.getenv("PROJECT_ID_RETRIES", "10"))
+
+# Cache of serialized project listings, keyed by the listing parameters.
+# It is kept in-process by default; set RESPONSE_CACHE_URL to a Redis URL to share it (and its invalidations) between workers.
+# Every committed write to the Project table invalidates it, see the event listeners below.
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "30"))
+projects_cache = ResponseCache(
+    create_cache_backend(RESPONSE_CACHE_URL, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL_SECONDS),
+    namespace="projects", ttl=RESPONSE_CACHE_TTL_SECONDS)
+
+# Number of rows fetched from the server-side cursor at a time when exporting the whole Project table.
+EXPORT_BATCH_SIZE = 1000
+
+# Maximum number of operations accepted in one request to the batch endpoint
+MAX_BATCH_OPERATIONS = 5000
+
+# Error returned when a conditional update (If-Match) finds that the project has a newer version
+VERSION_CONFLICT_DETAIL = "The project was changed by someone else, reload it and try again."
+
+# Key of the Postgres advisory lock that orders the writes to the project change log (see record_project_changes)
+PROJECT_CHANGES_LOCK_KEY = 7262002
+
+
+# These event listeners flag sessions that write to the Project table, either through the unit of work
+# or with bulk INSERT/UPDATE/DELETE statements, and invalidate the project listing cache once the write is committed.
+@event.listens_for(Session, "after_flush")
+def on_session_flush(session, flush_context):
+    if any(isinstance(obj, Project) for obj in chain(session.new, session.dirty, session.deleted)):
+        session.info["projects_changed"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def on_session_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ is Project:
+            orm_execute_state.session.info["projects_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def on_session_commit(session):
+    if session.info.pop("projects_changed", False):
+        projects_cache.invalidate()
+        search_index.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def on_session_rollback(session):
+    session.info.pop("projects_changed", None)
 
 
 # A function to create a new user in the database.
@@ -34,12 +111,22 @@ def create_user(session: Session, user_data: UserCreate):
 
 
 # A function to authenticate a user by checking the username and password.
-# It retrieves the user from the database and verifies the password.
+# It retrieves the user from the database and verifies the password,
+# rehashing it if it was hashed with an outdated cost factor. Unknown usernames take as long as a wrong password.
 def authenticate_user(session: Session, username: str, password: str):
     user = session.exec(select(User).where(User.username == username)).first()
-    if user and verify_password(password, user.hashed_password):
-        return user
-    return None
+    if user is None:
+        verify_dummy_password(password)
+        return None
+    valid, new_hash = verify_and_update_password(password, user.hashed_password)
+    if not valid:
+        return None
+    if new_hash:
+        user.hashed_password = new_hash
+        session.add(user)
+        session.commit()
+        session.refresh(user)
+    return user
 
 
 # A function to retrieve a user by username.
@@ -48,48 +135,465 @@ def get_user_by_username(session: Session, userid: str):
     # returns the first user that matches the username
     return session.exec(select(User).where(User.id == userid)).first()
 
+# A function to build the query that finds the next available project ID: the lowest ID freed by a deletion,
+# or else the one after the highest ID. Both are a single lookup at one end of a primary key index.
+def next_available_project_id_query():
+    lowest_free = select(func.min(ProjectFreeId.id)).scalar_subquery()
+    after_highest = select(func.coalesce(func.max(Project.id), 0) + 1).scalar_subquery()
+    return select(func.coalesce(lowest_free, after_highest))
+
+
 # A function to get the next available project ID.
-# It retrieves all used IDs from the database and finds the smallest missing positive integer.
+# It runs the query above, so the database does the lookup.
 def get_next_available_project_id(session: Session) -> int:
-    # Get all used IDs, ordered
-    used_ids = session.exec(select(Project.id).order_by(Project.id)).all()
+    return session.exec(next_available_project_id_query()).one()
+
+
+# A function to build the statement that takes the `count` lowest freed IDs out of ProjectFreeId and returns them.
+# On Postgres, SKIP LOCKED lets concurrent inserts take different IDs without waiting for each other, and an ID
+# taken by a transaction that rolls back is freed again with it.
+def take_free_project_ids_query(count: int):
+    lowest = select(ProjectFreeId.id).order_by(ProjectFreeId.id).limit(count).with_for_update(skip_locked=True)
+    return (delete(ProjectFreeId).where(ProjectFreeId.id.in_(lowest)).returning(ProjectFreeId.id)
+            .execution_options(synchronize_session=False))
+
+
+# A function to pick the IDs of `count` new projects according to the configured strategy.
+# With gap reuse it takes the lowest IDs freed by deletions; the projects it has no freed ID for (all of them with the
+# "sequence" strategy) get None, so the database assigns their ID.
+def allocate_project_ids(session: Session, count: int) -> List[Optional[int]]:
+    free_ids = []
+    if PROJECT_ID_STRATEGY != "sequence":
+        free_ids = sorted(session.exec(take_free_project_ids_query(count)).scalars().all())
+    return free_ids + [None] * (count - len(free_ids))
+
 
-    # Find the smallest missing positive integer
-    current = 1
-    for used_id in used_ids:
-        if used_id != current:
-            return current
-        current += 1
-    return current  # If no gaps, return next highest
+# A function to keep the IDs of deleted projects for reuse, with the "gap" strategy.
+def free_project_ids(session: Session, project_ids: List[int]):
+    if PROJECT_ID_STRATEGY != "sequence" and project_ids:
+        session.exec(insert(ProjectFreeId), params=[{"id": project_id} for project_id in project_ids])
+
+
+# A function to repair the ID allocation after an insert collided on the primary key, outside the failed transaction.
+# A freed ID can have been taken by a project inserted with an explicit ID (e.g. an import), so it is dropped;
+# the sequence can be behind IDs inserted explicitly, so it is moved past them.
+def repair_project_id(session: Session, new_id: Optional[int]):
+    if new_id is not None:
+        session.exec(delete(ProjectFreeId).where(ProjectFreeId.id == new_id)
+                     .execution_options(synchronize_session=False))
+    else:
+        sync_project_id_sequence(session.connection())
+    session.commit()
+
+
+# A function to compare project names the way the unique indexes on Project.name do.
+def project_name_key(name: str) -> str:
+    return name.lower() if PROJECT_NAME_CASE_INSENSITIVE else name
+
+
+# A function to build the query that checks whether a project name is already taken.
+# It is answered from the unique index on the name.
+def project_name_query(name: str):
+    if PROJECT_NAME_CASE_INSENSITIVE:
+        return select(Project.id).where(func.lower(Project.name) == name.lower()).limit(1)
+    return select(Project.id).where(Project.name == name).limit(1)
 
 
 # A function to create a new project in the database.
 # It takes a session and project data as input, creates a new Project object, and adds it to the session.
+# Duplicate names are rejected by the unique index on Project.name, so a successful insert is a single statement.
 def create_project(session: Session, project: ProjectCreate):
+    # An insert that collides on the primary key (see repair_project_id) backs off for a moment and tries again
+    for attempt in range(PROJECT_ID_RETRIES):
+        new_id = allocate_project_ids(session, 1)[0]
+        try:
+            db_project = Project(id=new_id, **project.dict())
+            session.add(db_project)
+            session.flush()
+            record_project_changes(session, "create", [db_project.model_dump()])
+            # Detach the project so the commit does not expire it and it can be returned without reloading it
+            session.expunge(db_project)
+            session.commit()
+            return db_project
+        except IntegrityError:
+            session.rollback()
+            if session.exec(project_name_query(project.name)).first() is not None:
+                raise HTTPException(
+                    status_code=400, detail="Project with this name already exists")
+            repair_project_id(session, new_id)
+            time.sleep(random.uniform(0, 0.005 * (attempt + 1)))
 
-    # Check if project with the same name already exists
-    existing_project = session.exec(
-        select(Project).where(Project.name == project.name)
-    ).first()
+    raise HTTPException(
+        status_code=503, detail="Could not assign an ID to the project, please try again.")
 
-    if existing_project:
-        raise HTTPException(
-            status_code=400, detail="Project with this name already exists")
 
-    new_id = get_next_available_project_id(session)
-    db_project = Project(id=new_id, **project.dict())
-    session.add(db_project)
-    session.commit()
-    session.refresh(db_project)
-    return db_project
+# A function to encode the position of the last returned row into an opaque cursor.
+# The cursor is a URL-safe base64 encoded JSON object, so clients can pass it back as-is.
+def encode_cursor(position: dict) -> str:
+    raw = json.dumps(position, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+# A function to decode a cursor previously returned by encode_cursor.
+# It raises an HTTPException if the cursor has been tampered with or is not valid.
+def decode_cursor(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except ValueError:
+        position = None
+    if not isinstance(position, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return position
 
 
-# A function to retrieve all projects from the database.
-# It uses a SQLAlchemy query to select all projects from the Project table.
-def get_projects(session: Session, sort_by: str = "desc"):
+# A function to turn the comma separated `fields` parameter into a list of project columns.
+# The id is always included because it is needed to build the cursor of the next page.
+def parse_project_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return list(PROJECT_FIELDS)
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(PROJECT_FIELDS)
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"Invalid fields: {', '.join(sorted(unknown))}. Use any of {', '.join(PROJECT_FIELDS)}.")
+    return [field for field in PROJECT_FIELDS if field == "id" or field in requested]
+
+
+# A function to build the query for a page of projects.
+# It uses keyset pagination on the primary key, so every page is a single index range scan of at most `limit` rows,
+# and only the requested columns are selected from the Project table. It returns the query and its column names.
+def projects_page_query(sort_by: str = "desc", limit: int = DEFAULT_PAGE_SIZE,
+                        cursor: Optional[str] = None, fields: Optional[str] = None):
     if sort_by not in ["asc", "desc"]:
         raise HTTPException(
             status_code=400, detail="Invalid sort parameter. Use 'asc' or 'desc'.")
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=400, detail=f"Invalid limit. Use a value between 1 and {MAX_PAGE_SIZE}.")
+
+    columns = parse_project_fields(fields)
+    statement = select(*[getattr(Project, column) for column in columns])
+
+    if cursor is not None:
+        position = decode_cursor(cursor)
+        if position.get("sort") != sort_by or not isinstance(position.get("id"), int):
+            raise HTTPException(
+                status_code=400, detail="Invalid cursor for this sort order.")
+        if sort_by == "asc":
+            statement = statement.where(Project.id > position["id"])
+        else:
+            statement = statement.where(Project.id < position["id"])
 
     order = Project.id.asc() if sort_by == "asc" else Project.id.desc()
-    return session.exec(select(Project).order_by(order)).all()
+    # Fetch one extra row to find out whether there is a next page without a COUNT query
+    return statement.order_by(order).limit(limit + 1), columns
+
+
+# A function to turn the rows returned by a projects_page_query into a page of projects.
+# The next_cursor is None when there are no more projects.
+def projects_page(rows, columns: List[str], sort_by: str, limit: int):
+    projects = [dict(zip(columns, row)) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor({"sort": sort_by, "id": projects[-1]["id"]})
+    return {"projects": projects, "next_cursor": next_cursor}
+
+
+# A function to build the project listing cache key of a set of listing parameters.
+def projects_cache_key(sort_by: str, limit: int, cursor: Optional[str], fields: Optional[str]) -> str:
+    return f"{sort_by}|{limit}|{cursor or ''}|{','.join(parse_project_fields(fields))}"
+
+
+# A function to retrieve a page of projects from the database.
+# See projects_page_query for the supported parameters.
+def get_projects(session: Session, sort_by: str = "desc", limit: int = DEFAULT_PAGE_SIZE,
+                 cursor: Optional[str] = None, fields: Optional[str] = None):
+    statement, columns = projects_page_query(sort_by, limit, cursor, fields)
+    rows = session.exec(statement).all()
+    return projects_page(rows, columns, sort_by, limit)
+
+
+# A function to search projects by name and description, best matches first.
+# It uses Postgres full-text and trigram search when available, and the in-process inverted index otherwise.
+# Pages are chained with the same opaque cursors as the project listing, positioned on (score, id).
+def search_projects(session: Session, q: str, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None):
+    if not tokenize(q):
+        raise HTTPException(
+            status_code=400, detail="Invalid search query. Use at least one letter or digit.")
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=400, detail=f"Invalid limit. Use a value between 1 and {MAX_PAGE_SIZE}.")
+
+    position = None
+    if cursor is not None:
+        position = decode_cursor(cursor)
+        if (position.get("q") != q or not isinstance(position.get("id"), int)
+                or not isinstance(position.get("score"), (int, float))):
+            raise HTTPException(
+                status_code=400, detail="Invalid cursor for this search.")
+
+    if session.get_bind().dialect.name == "postgresql":
+        session.exec(similarity_threshold_query())
+        matches = postgres_search_query(q).subquery()
+        statement = select(matches.c.id, matches.c.name, matches.c.description, matches.c.score)
+        if position is not None:
+            statement = statement.where(or_(
+                matches.c.score < position["score"],
+                and_(matches.c.score == position["score"], matches.c.id > position["id"])))
+        rows = session.exec(statement.order_by(matches.c.score.desc(), matches.c.id.asc()).limit(limit + 1)).all()
+    else:
+        rows = []
+        for score, project_id, name, description in search_index.search(session, q):
+            if position is not None and (score, -project_id) >= (position["score"], -position["id"]):
+                continue
+            rows.append((project_id, name, description, score))
+            if len(rows) > limit:
+                break
+
+    projects = [dict(zip(("id", "name", "description", "score"), row)) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor({"q": q, "score": projects[-1]["score"], "id": projects[-1]["id"]})
+    return {"projects": projects, "next_cursor": next_cursor}
+
+
+# A function to build the statement updating a project and returning its new state.
+# With expected_version, only that version of the project is updated; every update increments the version.
+def project_update_query(project_id: int, changes: dict, expected_version: Optional[int] = None):
+    statement = update(Project).where(Project.id == project_id)
+    if expected_version is not None:
+        statement = statement.where(Project.version == expected_version)
+    return statement.values(**changes, version=Project.version + 1).returning(
+        *[getattr(Project, field) for field in PROJECT_FIELDS]).execution_options(synchronize_session=False)
+
+
+# A function to get a project by its ID, as a dict of PROJECT_FIELDS.
+def get_project(session: Session, project_id: int) -> dict:
+    project = session.exec(select(*[getattr(Project, field) for field in PROJECT_FIELDS])
+                           .where(Project.id == project_id)).first()
+    if project is None:
+        raise HTTPException(status_code=404, detail="Project not found")
+    return dict(project._mapping)
+
+
+# A function to update a project with a single UPDATE ... RETURNING statement, and return the updated project.
+# With expected_version (from an If-Match header), the update only applies if nobody changed the project since that
+# version, and fails with 412 otherwise. Without changes, the project is returned as is.
+def update_project(session: Session, project_id: int, changes: dict, expected_version: Optional[int] = None):
+    if not changes:
+        project = get_project(session, project_id)
+        if expected_version is not None and project["version"] != expected_version:
+            raise HTTPException(status_code=412, detail=VERSION_CONFLICT_DETAIL)
+        return project
+
+    try:
+        project = session.exec(project_update_query(project_id, changes, expected_version)).first()
+        if project is not None:
+            record_project_changes(session, "update", [project._mapping])
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        raise HTTPException(
+            status_code=400, detail="Project with this name already exists")
+
+    if project is None:
+        # Nothing was updated: tell a missing project from a version conflict
+        if expected_version is None or session.get(Project, project_id) is None:
+            raise HTTPException(status_code=404, detail="Project not found")
+        raise HTTPException(status_code=412, detail=VERSION_CONFLICT_DETAIL)
+    return dict(project._mapping)
+
+
+# A function to delete a project with a single DELETE ... RETURNING statement, and return the deleted project.
+def delete_project(session: Session, project_id: int) -> dict:
+    project = session.exec(delete(Project).where(Project.id == project_id).returning(
+        *[getattr(Project, field) for field in PROJECT_FIELDS]).execution_options(synchronize_session=False)).first()
+    if project is None:
+        raise HTTPException(status_code=404, detail="Project not found")
+    free_project_ids(session, [project_id])
+    record_project_changes(session, "delete", [project._mapping])
+    session.commit()
+    return dict(project._mapping)
+
+
+# A function to build the rows of the project change log for projects changed by one operation.
+# projects are mappings of PROJECT_FIELDS; deletions only log the project id. A reload (a bulk import, which tells
+# consumers to read the whole list again) is a single entry without a project, and ignores projects.
+def project_change_rows(operation: str, projects) -> List[dict]:
+    changed_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    if operation == "reload":
+        return [{"operation": operation, "changed_at": changed_at}]
+    if operation == "delete":
+        return [{"operation": operation, "project_id": project["id"], "changed_at": changed_at} for project in projects]
+    return [{"operation": operation, "project_id": project["id"], "name": project["name"],
+             "description": project["description"], "version": project["version"], "changed_at": changed_at}
+            for project in projects]
+
+
+# A function to append changes of projects to the change log, in the transaction that makes them.
+# On Postgres it first takes an advisory lock held until the commit, so log entries are committed in the order of
+# their sequence numbers and a consumer reading "since" its last entry can never skip one committed late.
+def record_project_changes(session: Session, operation: str, projects):
+    rows = project_change_rows(operation, projects)
+    if not rows:
+        return
+    if session.get_bind().dialect.name == "postgresql":
+        session.exec(select(func.pg_advisory_xact_lock(PROJECT_CHANGES_LOCK_KEY)))
+    session.exec(insert(ProjectChange), params=rows)
+
+
+# A function to build the query for the project changes logged after `since`, oldest first.
+def project_changes_query(since: int, limit: int):
+    return select(ProjectChange).where(ProjectChange.seq > since).order_by(ProjectChange.seq.asc()).limit(limit + 1)
+
+
+# A function to turn the change log entries returned by project_changes_query into a page of changes.
+# next_since is the `since` to pass to get the following changes; has_more tells whether there are more already.
+def project_changes_page(entries, since: int, limit: int) -> dict:
+    changes = []
+    for entry in entries[:limit]:
+        project = None
+        if entry.operation in ("create", "update"):
+            project = {"id": entry.project_id, "name": entry.name, "description": entry.description,
+                       "version": entry.version}
+        changes.append({"seq": entry.seq, "op": entry.operation, "project_id": entry.project_id, "project": project,
+                        "changed_at": entry.changed_at.isoformat() + "Z"})
+    return {"changes": changes, "next_since": changes[-1]["seq"] if changes else since,
+            "has_more": len(entries) > limit}
+
+
+# A function to get the project changes logged after `since` (a `seq`, 0 for the start of the log).
+def get_project_changes(session: Session, since: int = 0, limit: int = DEFAULT_PAGE_SIZE) -> dict:
+    return project_changes_page(session.exec(project_changes_query(since, limit)).all(), since, limit)
+
+
+# A function to iterate over every project in batches, ordered by id.
+# It streams the rows from a server-side cursor, so only one batch of rows is held in memory at any time.
+def iter_project_batches(session: Session, batch_size: int = EXPORT_BATCH_SIZE):
+    statement = select(*[getattr(Project, field) for field in PROJECT_FIELDS]).order_by(
+        Project.id.asc()).execution_options(yield_per=batch_size)
+    for rows in session.exec(statement).partitions():
+        yield rows
+
+
+# A function to apply a batch of create/update/delete operations on projects in a single transaction.
+# Operations are validated together with set-based queries (one for the referenced IDs, one for the names),
+# then written with one multi-row DELETE, UPDATE and INSERT each. It returns one result per operation, in order;
+# invalid operations are reported and skipped, or abort the whole batch when `atomic` is set.
+def apply_project_batch(session: Session, operations: List[ProjectOperation], atomic: bool = False):
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise HTTPException(
+            status_code=400, detail=f"Too many operations. Send at most {MAX_BATCH_OPERATIONS} per batch.")
+
+    results = [None] * len(operations)
+
+    def fail(index, status_code, detail):
+        results[index] = {"index": index, "op": operations[index].op, "status": status_code, "detail": detail}
+
+    # Check the shape of every operation and that no project is touched twice in the same batch
+    seen_ids = set()
+    for index, operation in enumerate(operations):
+        if operation.op not in ("create", "update", "delete"):
+            fail(index, 400, "Invalid operation. Use 'create', 'update' or 'delete'.")
+        elif operation.op == "create" and (operation.name is None or operation.description is None):
+            fail(index, 400, "A create operation requires a name and a description.")
+        elif operation.op != "create" and operation.id is None:
+            fail(index, 400, f"An {operation.op} operation requires an id.")
+        elif operation.op == "update" and operation.name is None and operation.description is None:
+            fail(index, 400, "An update operation requires a name or a description.")
+        elif operation.op != "create" and operation.id in seen_ids:
+            fail(index, 400, "This project appears more than once in the batch.")
+        elif operation.op != "create":
+            seen_ids.add(operation.id)
+
+    # Check that updated and deleted projects exist, with one query
+    existing_ids = set()
+    if seen_ids:
+        existing_ids = set(session.exec(select(Project.id).where(Project.id.in_(seen_ids))).all())
+    for index, operation in enumerate(operations):
+        if results[index] is None and operation.op != "create" and operation.id not in existing_ids:
+            fail(index, 404, "Project not found")
+
+    # Check that new names are unique within the batch and in the table, with one query.
+    # Names of projects deleted in this batch can be reused.
+    deleted_ids = {operation.id for index, operation in enumerate(operations)
+                   if results[index] is None and operation.op == "delete"}
+    named = [(index, operation) for index, operation in enumerate(operations)
+             if results[index] is None and operation.op != "delete" and operation.name is not None]
+    taken = {}
+    if named:
+        keys = {project_name_key(operation.name) for _, operation in named}
+        column = func.lower(Project.name) if PROJECT_NAME_CASE_INSENSITIVE else Project.name
+        taken = {project_name_key(name): project_id for name, project_id in session.exec(
+            select(Project.name, Project.id).where(column.in_(keys))).all()}
+    batch_names = set()
+    for index, operation in named:
+        key = project_name_key(operation.name)
+        owner = taken.get(key)
+        if key in batch_names:
+            fail(index, 400, "This project name appears more than once in the batch.")
+        elif owner is not None and owner != operation.id and owner not in deleted_ids:
+            fail(index, 400, "Project with this name already exists")
+        batch_names.add(key)
+
+    if atomic and any(result is not None for result in results):
+        raise HTTPException(status_code=400, detail={
+            "message": "The batch was not applied because some operations are invalid.",
+            "results": [result for result in results if result is not None]})
+
+    deletes = [index for index, operation in enumerate(operations)
+               if results[index] is None and operation.op == "delete"]
+    updates = [index for index, operation in enumerate(operations)
+               if results[index] is None and operation.op == "update"]
+    creates = [index for index, operation in enumerate(operations)
+               if results[index] is None and operation.op == "create"]
+
+    new_ids = []
+    try:
+        if deletes:
+            delete_ids = [operations[i].id for i in deletes]
+            session.exec(delete(Project).where(Project.id.in_(delete_ids))
+                         .execution_options(synchronize_session=False))
+            free_project_ids(session, delete_ids)
+            record_project_changes(session, "delete", [{"id": project_id} for project_id in delete_ids])
+        if updates:
+            # One UPDATE for all the rows: each column is set with a CASE on the project ID, columns left out of
+            # an operation keep their value, and versions are bumped
+            update_ids = [operations[i].id for i in updates]
+            changes = {"version": Project.version + 1}
+            for field in ("name", "description"):
+                new_values = {operations[i].id: getattr(operations[i], field)
+                              for i in updates if getattr(operations[i], field) is not None}
+                if new_values:
+                    changes[field] = case(new_values, value=Project.id, else_=getattr(Project, field))
+            updated = session.exec(update(Project).where(Project.id.in_(update_ids)).values(**changes)
+                                   .returning(*[getattr(Project, field) for field in PROJECT_FIELDS])
+                                   .execution_options(synchronize_session=False)).all()
+            record_project_changes(session, "update", [row._mapping for row in updated])
+        if creates:
+            # Projects that get a freed ID are inserted with it, the others with one statement assigning them IDs
+            rows = [{"name": operations[i].name, "description": operations[i].description} for i in creates]
+            allocated = allocate_project_ids(session, len(rows))
+            reused = [{**row, "id": new_id} for row, new_id in zip(rows, allocated) if new_id is not None]
+            if reused:
+                session.exec(insert(Project), params=reused)
+            new_ids = [row["id"] for row in reused]
+            if len(reused) < len(rows):
+                new_ids += session.exec(insert(Project).returning(Project.id, sort_by_parameter_order=True),
+                                        params=rows[len(reused):]).scalars().all()
+            record_project_changes(session, "create", [
+                {**row, "id": new_id, "version": 1} for row, new_id in zip(rows, new_ids)])
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        raise HTTPException(
+            status_code=409, detail="The batch conflicts with a concurrent change, please try again.")
+
+    for index in deletes:
+        results[index] = {"index": index, "op": "delete", "status": 200, "id": operations[index].id}
+    for index in updates:
+        results[index] = {"index": index, "op": "update", "status": 200, "id": operations[index].id}
+    for index, new_id in zip(creates, new_ids):
+        results[index] = {"index": index, "op": "create", "status": 201, "id": new_id}
+    return results
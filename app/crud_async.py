@@ -0,0 +1,164 @@
+'''
+Async versions of the CRUD operations in app/crud.py, used when DATABASE_MODE is "async".
+They build the same queries as their sync counterparts and only differ in awaiting the AsyncSession.
+'''
+
+
+import asyncio
+import random
+from typing import List, Optional
+from fastapi import HTTPException
+from sqlalchemy import delete, func, insert
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.models import User, Project, ProjectChange, ProjectFreeId, UserCreate, ProjectCreate
+from app.auth import hash_password_async, verify_and_update_password_async, verify_dummy_password_async
+from app import crud
+
+
+# A function to create a new user in the database.
+# It takes a session and user data as input, hashes the password, and adds the user to the session.
+async def create_user(session: AsyncSession, user_data: UserCreate):
+    existing_user = (await session.exec(select(User).where(
+        User.username == user_data.username))).first()
+    if existing_user:
+        raise HTTPException(
+            status_code=400, detail="Username already registered")
+
+    if user_data.role not in ["admin", "user"]:
+        raise HTTPException(
+            status_code=400, detail="Invalid role. Use 'admin' or 'user'.")
+
+    user = User(
+        username=user_data.username,
+        hashed_password=await hash_password_async(user_data.password),
+        role=user_data.role
+    )
+    session.add(user)
+    await session.commit()
+    await session.refresh(user)
+    return user
+
+
+# A function to authenticate a user by checking the username and password.
+# It retrieves the user from the database and verifies the password,
+# rehashing it if it was hashed with an outdated cost factor.
+async def authenticate_user(session: AsyncSession, username: str, password: str):
+    user = (await session.exec(select(User).where(User.username == username))).first()
+    if user is None:
+        await verify_dummy_password_async(password)
+        return None
+    valid, new_hash = await verify_and_update_password_async(password, user.hashed_password)
+    if not valid:
+        return None
+    if new_hash:
+        user.hashed_password = new_hash
+        session.add(user)
+        await session.commit()
+        await session.refresh(user)
+    return user
+
+
+# A function to retrieve a user by id.
+async def get_user_by_username(session: AsyncSession, userid: str):
+    return (await session.exec(select(User).where(User.id == userid))).first()
+
+
+# A function to pick the IDs of `count` new projects, see crud.allocate_project_ids.
+async def allocate_project_ids(session: AsyncSession, count: int) -> List[Optional[int]]:
+    free_ids = []
+    if crud.PROJECT_ID_STRATEGY != "sequence":
+        free_ids = sorted((await session.exec(crud.take_free_project_ids_query(count))).scalars().all())
+    return free_ids + [None] * (count - len(free_ids))
+
+
+# A function to create a new project in the database.
+# Like crud.create_project, it relies on the unique index on Project.name to reject duplicate names.
+async def create_project(session: AsyncSession, project: ProjectCreate):
+    for attempt in range(crud.PROJECT_ID_RETRIES):
+        new_id = (await allocate_project_ids(session, 1))[0]
+        try:
+            db_project = Project(id=new_id, **project.dict())
+            session.add(db_project)
+            await session.flush()
+            await record_project_changes(session, "create", [db_project.model_dump()])
+            session.expunge(db_project)
+            await session.commit()
+            return db_project
+        except IntegrityError:
+            await session.rollback()
+            if (await session.exec(crud.project_name_query(project.name))).first() is not None:
+                raise HTTPException(
+                    status_code=400, detail="Project with this name already exists")
+            await session.run_sync(crud.repair_project_id, new_id)
+            await asyncio.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+
+    raise HTTPException(
+        status_code=503, detail="Could not assign an ID to the project, please try again.")
+
+
+# A function to retrieve a page of projects from the database.
+# See crud.projects_page_query for the supported parameters.
+async def get_projects(session: AsyncSession, sort_by: str = "desc", limit: int = crud.DEFAULT_PAGE_SIZE,
+                       cursor=None, fields=None):
+    statement, columns = crud.projects_page_query(sort_by, limit, cursor, fields)
+    rows = (await session.exec(statement)).all()
+    return crud.projects_page(rows, columns, sort_by, limit)
+
+
+# A function to get a project by its ID, as a dict of crud.PROJECT_FIELDS.
+async def get_project(session: AsyncSession, project_id: int) -> dict:
+    project = (await session.exec(select(*[getattr(Project, field) for field in crud.PROJECT_FIELDS])
+                                  .where(Project.id == project_id))).first()
+    if project is None:
+        raise HTTPException(status_code=404, detail="Project not found")
+    return dict(project._mapping)
+
+
+# A function to update a project with a single UPDATE ... RETURNING statement, see crud.update_project.
+async def update_project(session: AsyncSession, project_id: int, changes: dict, expected_version: Optional[int] = None):
+    if not changes:
+        project = await get_project(session, project_id)
+        if expected_version is not None and project["version"] != expected_version:
+            raise HTTPException(status_code=412, detail=crud.VERSION_CONFLICT_DETAIL)
+        return project
+
+    try:
+        project = (await session.exec(crud.project_update_query(project_id, changes, expected_version))).first()
+        if project is not None:
+            await record_project_changes(session, "update", [project._mapping])
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        raise HTTPException(
+            status_code=400, detail="Project with this name already exists")
+
+    if project is None:
+        if expected_version is None or await session.get(Project, project_id) is None:
+            raise HTTPException(status_code=404, detail="Project not found")
+        raise HTTPException(status_code=412, detail=crud.VERSION_CONFLICT_DETAIL)
+    return dict(project._mapping)
+
+
+# A function to delete a project with a single DELETE ... RETURNING statement, see crud.delete_project.
+async def delete_project(session: AsyncSession, project_id: int) -> dict:
+    project = (await session.exec(delete(Project).where(Project.id == project_id).returning(
+        *[getattr(Project, field) for field in crud.PROJECT_FIELDS]).execution_options(synchronize_session=False))).first()
+    if project is None:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if crud.PROJECT_ID_STRATEGY != "sequence":
+        await session.exec(insert(ProjectFreeId).values(id=project_id))
+    await record_project_changes(session, "delete", [project._mapping])
+    await session.commit()
+    return dict(project._mapping)
+
+
+# A function to append changes of projects to the change log, see crud.record_project_changes.
+async def record_project_changes(session: AsyncSession, operation: str, projects):
+    rows = crud.project_change_rows(operation, projects)
+    if not rows:
+        return
+    if session.bind.dialect.name == "postgresql":
+        await session.exec(select(func.pg_advisory_xact_lock(crud.PROJECT_CHANGES_LOCK_KEY)))
+    await session.exec(insert(ProjectChange), params=rows)
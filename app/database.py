@@ -4,12 +4,29 @@ Database connection and session management for SQLModel.
 
 
 from sqlmodel import SQLModel, create_engine, Session
+from sqlalchemy import event, exc, func, insert, inspect, select, text
+from sqlalchemy.schema import CreateColumn, CreateIndex
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlmodel.ext.asyncio.session import AsyncSession
+from fastapi import Request
+import asyncio
+import hashlib
+import itertools
+import logging
+import math
 import os
-from dotenv import load_dotenv
+import threading
+import time
+import uuid
+from typing import List, Optional
+from app.cache import TTLCache
+from app.config import env_flag
+from app.instrumentation import record_query
+from app.models import Project, ProjectFreeId
+from app.search import ensure_search_indexes
 
 
-# Load environment variables from .env file
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 
 # Database URL from environment variable
@@ -17,30 +34,588 @@ load_dotenv()
 DATABASE_URL = os.getenv("ORACLE_POSTGRES_URL")
 
 
-# Create a SQLModel engine using the database URL
-# The engine is responsible for managing the connection to the database and executing SQL queries.
-try:
-    engine = create_engine(DATABASE_URL, echo=True)
-except Exception as e:
-    raise RuntimeError(f"Failed to create database engine: {e}")
+# Database mode: "sync" (the default) serves every route from the threadpool with the engine below,
+# "async" also creates an AsyncEngine and serves the core routes from the event loop (see app/routes_async.py).
+DATABASE_MODE = os.getenv("DATABASE_MODE", "sync").lower()
 
-# Function to get the engine
-# This function returns the engine object created above to be used for generating project mock-data.
+
+# Async drivers used for the async engine when ASYNC_DATABASE_URL is not set
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+# Function to derive the URL of the async engine from the sync database URL
+# It swaps the driver part of the URL, e.g. postgresql://... becomes postgresql+asyncpg://...
+def to_async_url(url: str) -> str:
+    scheme, separator, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + separator + rest
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or (
+    to_async_url(DATABASE_URL) if DATABASE_URL else None)
+
+
+# Read replicas: comma separated database URLs that serve the read-only routes (see get_read_session).
+# Writes always go to the primary (DATABASE_URL). Without replicas, every route uses the primary.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# Seconds between two health checks of the replicas, and seconds a failing replica is left out before it is retried
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))
+DB_REPLICA_RETRY_SECONDS = float(os.getenv("DB_REPLICA_RETRY_SECONDS", "30"))
+# A PostgreSQL replica replaying changes later than this many seconds is left out; 0 disables the lag check
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "10"))
+# Seconds during which the reads of a client that just wrote go to the primary, so it reads its own writes
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+# Cookie carrying the time of the last write of a client, so every worker and app instance sends its reads to the primary
+READ_YOUR_WRITES_COOKIE = os.getenv("READ_YOUR_WRITES_COOKIE", "last_write")
+# Seconds after a write during which a replica may still return the data from before it
+REPLICA_STALE_SECONDS = max(DB_REPLICA_MAX_LAG_SECONDS, READ_YOUR_WRITES_SECONDS)
+
+
+# Engine and connection pool settings
+# SQL statements are only logged when DB_ECHO is set, logging every statement is too costly under load.
+# DB_PGBOUNCER disables server-side prepared statements, which PgBouncer in transaction pooling mode does not support.
+DB_ECHO = env_flag("DB_ECHO")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = env_flag("DB_POOL_PRE_PING", True)
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+DB_PGBOUNCER = env_flag("DB_PGBOUNCER")
+# Connections opened in the background at startup, so the first requests do not pay for them
+DB_POOL_WARMUP = int(os.getenv("DB_POOL_WARMUP", str(DB_POOL_SIZE)))
+
+
+# Schema initialization at startup:
+# "auto" (the default) creates the tables and indexes, unless the database is managed by migrations (it has a
+# migration version table); "create" always does; "defer" does the same as "auto" in the background, after the app
+# started serving; "skip" never does.
+SCHEMA_INIT = os.getenv("SCHEMA_INIT", "auto").lower()
+MIGRATION_VERSION_TABLE = os.getenv("MIGRATION_VERSION_TABLE", "alembic_version")
+
+
+# A class adding checkout counters to a connection pool
+# It records how long requests waited for a connection (including opening a new one) and how many timed out.
+class PoolWaitStats:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+
+
+class TimedQueuePool(PoolWaitStats, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(PoolWaitStats, AsyncAdaptedQueuePool):
+    pass
+
+
+# Function to build the keyword arguments of create_engine/create_async_engine from the settings above
+# SQLite has no server to pool connections to, so it keeps the SQLAlchemy defaults.
+def engine_options(url: str, is_async: bool = False) -> dict:
+    options = {"echo": DB_ECHO}
+    if url.startswith("sqlite"):
+        return options
+
+    options.update(
+        poolclass=TimedAsyncQueuePool if is_async else TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+    connect_args = {}
+    if is_async:
+        if DB_STATEMENT_TIMEOUT_MS:
+            connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+        if DB_PGBOUNCER:
+            connect_args.update(
+                statement_cache_size=0,
+                prepared_statement_cache_size=0,
+                prepared_statement_name_func=lambda: f"__asyncpg_{uuid.uuid4()}__",
+            )
+    elif DB_STATEMENT_TIMEOUT_MS:
+        connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+
+# Function to describe the state of the connection pool of an engine
+# It reports the pool size, connections in use and overflow, and the checkout wait times recorded by PoolWaitStats.
+def pool_stats(db_engine) -> dict:
+    pool = db_engine.pool
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), checked_in=pool.checkedin(),
+                     checked_out=pool.checkedout(), overflow=pool.overflow())
+    if isinstance(pool, PoolWaitStats):
+        stats.update(
+            checkouts=pool.checkouts,
+            timeouts=pool.timeouts,
+            avg_wait_ms=round(pool.total_wait / pool.checkouts * 1000, 3) if pool.checkouts else 0.0,
+            max_wait_ms=round(pool.max_wait * 1000, 3),
+        )
+    return stats
 
 
+# Function to time every SQL statement run by an engine
+# The durations are added to the timings of the current request (see app/instrumentation.py); outside requests they are ignored.
+def instrument_queries(db_engine):
+    @event.listens_for(db_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(db_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        record_query(statement, (time.perf_counter() - conn.info["query_start_time"].pop()) * 1000)
+
+    @event.listens_for(db_engine, "handle_error")
+    def handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_start_time"):
+            connection.info["query_start_time"].pop()
+
+
+# Functions to create an engine from a URL, with the pool settings and the query instrumentation
+def create_db_engine(url: str):
+    try:
+        db_engine = create_engine(url, **engine_options(url))
+    except Exception as e:
+        raise RuntimeError(f"Failed to create database engine: {e}")
+    instrument_queries(db_engine)
+    return db_engine
+
+
+def create_async_db_engine(url: str):
+    from sqlalchemy.ext.asyncio import create_async_engine
+    try:
+        db_engine = create_async_engine(url, **engine_options(url, is_async=True))
+    except Exception as e:
+        raise RuntimeError(f"Failed to create async database engine: {e}")
+    instrument_queries(db_engine.sync_engine)
+    return db_engine
+
+
+# The engines are created on first use rather than at import, so importing the app (and every worker boot) does not
+# load the database driver or read any setting it does not need yet.
+_engine = None
+_async_engine = None
+_engine_lock = threading.Lock()
+
+
+# Function to get the engine
+# The engine is responsible for managing the connection to the database and executing SQL queries.
+# It is created on the first call, from the database URL.
 def get_engine():
-    return engine
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_db_engine(DATABASE_URL)
+    return _engine
+
+
+# Function to get the async engine, created on the first call; it is None unless DATABASE_MODE is "async".
+# The sync engine is still used in async mode, it serves the routes that have no async version and the utility scripts.
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None and DATABASE_MODE == "async":
+        with _engine_lock:
+            if _async_engine is None:
+                _async_engine = create_async_db_engine(ASYNC_DATABASE_URL)
+    return _async_engine
+
+
+# The module attributes `engine` and `async_engine` are still available; they create the engines on first access.
+def __getattr__(name):
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# A class representing the read replicas, chosen in turn (round-robin) for each read-only request.
+# A replica that fails a health check or loses a connection is left out for DB_REPLICA_RETRY_SECONDS; when every
+# replica is out, reads go to the primary. Engines are created on first use, like the primary ones.
+class ReplicaSet:
+    def __init__(self, urls: List[str]):
+        self.urls = urls
+        self.down_until = [0.0] * len(urls)
+        self._engines = [None] * len(urls)
+        self._async_engines = [None] * len(urls)
+        self._turns = itertools.count()
+        self._lock = threading.Lock()
+
+    def engine(self, index: int):
+        if self._engines[index] is None:
+            with self._lock:
+                if self._engines[index] is None:
+                    db_engine = create_db_engine(self.urls[index])
+                    self._watch_errors(db_engine, index)
+                    self._engines[index] = db_engine
+        return self._engines[index]
+
+    def async_engine(self, index: int):
+        if self._async_engines[index] is None:
+            with self._lock:
+                if self._async_engines[index] is None:
+                    db_engine = create_async_db_engine(to_async_url(self.urls[index]))
+                    self._watch_errors(db_engine.sync_engine, index)
+                    self._async_engines[index] = db_engine
+        return self._async_engines[index]
+
+    # Leaves a replica out as soon as one of its connections fails or is dropped, without waiting for the next check.
+    def _watch_errors(self, db_engine, index: int):
+        @event.listens_for(db_engine, "handle_error")
+        def handle_error(exception_context):
+            if exception_context.is_disconnect or exception_context.connection is None:
+                self.mark_down(index, exception_context.original_exception)
+
+    # Returns the index of the next healthy replica, or None if there is none.
+    def choose(self) -> Optional[int]:
+        now = time.monotonic()
+        for _ in range(len(self.urls)):
+            index = next(self._turns) % len(self.urls)
+            if self.down_until[index] <= now:
+                return index
+        return None
+
+    def mark_down(self, index: int, reason):
+        if self.down_until[index] <= time.monotonic():
+            logger.warning("Read replica %d is unavailable, reading from the primary: %s", index, reason)
+        self.down_until[index] = time.monotonic() + DB_REPLICA_RETRY_SECONDS
+
+    # Checks that a replica answers, and on PostgreSQL that it does not lag behind the primary too much.
+    # The lag is 0 when the replica has replayed everything it received, so an idle primary does not look lagging.
+    def check(self, index: int):
+        try:
+            with self.engine(index).connect() as connection:
+                if connection.dialect.name != "postgresql" or not DB_REPLICA_MAX_LAG_SECONDS:
+                    connection.execute(text("SELECT 1"))
+                    lag = 0.0
+                else:
+                    lag = connection.execute(text(
+                        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                        "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+                    )).scalar() or 0.0
+        except exc.SQLAlchemyError as e:
+            self.mark_down(index, e)
+            return
+        if lag > DB_REPLICA_MAX_LAG_SECONDS:
+            self.mark_down(index, f"replication lag of {lag:.1f}s")
+        elif self.down_until[index]:
+            logger.info("Read replica %d is available again", index)
+            self.down_until[index] = 0.0
+
+    def check_all(self):
+        for index in range(len(self.urls)):
+            self.check(index)
+
+    def stats(self) -> list:
+        now = time.monotonic()
+        return [{"healthy": self.down_until[index] <= now,
+                 **(pool_stats(self._engines[index]) if self._engines[index] is not None else {})}
+                for index in range(len(self.urls))]
+
+    async def dispose(self):
+        for index in range(len(self.urls)):
+            if self._engines[index] is not None:
+                self._engines[index].dispose()
+            if self._async_engines[index] is not None:
+                await self._async_engines[index].dispose()
+
+
+replicas = ReplicaSet(DATABASE_REPLICA_URLS)
+_replica_checks_stop = threading.Event()
+
+
+# Function to check the health of the replicas every DB_REPLICA_CHECK_INTERVAL seconds, in a background thread
+def start_replica_health_checks():
+    if not replicas.urls:
+        return
+
+    def run():
+        while not _replica_checks_stop.is_set():
+            replicas.check_all()
+            _replica_checks_stop.wait(DB_REPLICA_CHECK_INTERVAL)
+
+    _replica_checks_stop.clear()
+    threading.Thread(target=run, name="db-replica-checks", daemon=True).start()
+
+
+# Function to close every connection of the engines that were created, called at shutdown
+async def dispose_engines():
+    _replica_checks_stop.set()
+    if _engine is not None:
+        _engine.dispose()
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    await replicas.dispose()
+
+
+# Clients that wrote recently, keyed by a digest of their Authorization header; their reads go to the primary.
+# This only covers the worker that served the write; the READ_YOUR_WRITES_COOKIE carries the pin to the others.
+recent_writers = TTLCache(maxsize=int(os.getenv("READ_YOUR_WRITES_CACHE_SIZE", "10000")), ttl=READ_YOUR_WRITES_SECONDS)
+
+
+# Function to identify the client of a request for read-your-writes, by its token; None for anonymous requests
+def client_key(request: Request) -> Optional[bytes]:
+    authorization = request.headers.get("authorization")
+    return hashlib.blake2b(authorization.encode(), digest_size=16).digest() if authorization else None
+
+
+# This event listener pins the client of a session to the primary once the session commits a transaction,
+# in this worker and, through the request state read by ReadYourWritesMiddleware, with the cookie of the response
+@event.listens_for(Session, "after_commit")
+def on_session_commit(session):
+    key = session.info.get("client_key")
+    if key is not None:
+        recent_writers.set(key, True)
+    state = session.info.get("request_state")
+    if state is not None:
+        state[READ_YOUR_WRITES_COOKIE] = time.time()
+
+
+# Function to tell whether the client of a request wrote less than READ_YOUR_WRITES_SECONDS ago,
+# according to this worker or to the cookie set on its last write (by any worker).
+# The cookie is not signed, so a time in the future is taken as now: a forged cookie pins its client to the primary
+# for one READ_YOUR_WRITES_SECONDS window at most, the same as a real write would.
+def wrote_recently(request: Request) -> bool:
+    key = client_key(request)
+    if key is not None and recent_writers.get(key):
+        return True
+    try:
+        last_write = float(request.cookies.get(READ_YOUR_WRITES_COOKIE, ""))
+    except ValueError:
+        return False
+    now = time.time()
+    return now - min(last_write, now) < READ_YOUR_WRITES_SECONDS
+
+
+# A class representing an ASGI middleware that sets the READ_YOUR_WRITES_COOKIE on the responses of requests that
+# committed a write. The cookie expires with the pin, so the client stops sending it once replicas have caught up.
+class ReadYourWritesMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message):
+            last_write = scope.get("state", {}).get(READ_YOUR_WRITES_COOKIE)
+            if message["type"] == "http.response.start" and last_write is not None:
+                cookie = (f"{READ_YOUR_WRITES_COOKIE}={last_write:.3f}; Max-Age={math.ceil(READ_YOUR_WRITES_SECONDS)}; "
+                          "Path=/; HttpOnly; SameSite=Lax")
+                message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", cookie.encode())]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+
+# Function to choose the replica serving a read-only request: None (the primary) when there is no healthy replica or
+# the client wrote recently
+def choose_replica(request: Request) -> Optional[int]:
+    if not replicas.urls:
+        return None
+    if wrote_recently(request):
+        return None
+    return replicas.choose()
+
+
+# Function to get the engine of a read-only request, for the code that opens its own session (e.g. streamed exports)
+def get_read_engine(request: Request):
+    index = choose_replica(request)
+    return get_engine() if index is None else replicas.engine(index)
+
+
+# Function to build the info of the sessions writing for a request: the client, and the request state on which
+# on_session_commit records the time of the write
+def write_session_info(request: Request) -> dict:
+    return {"client_key": client_key(request), "request_state": request.scope.setdefault("state", {})}
+
 
 # Create a session generator function
 # This function creates a new session for each request and closes it after use.
+# Sessions remember the client of the request, so it reads its own writes (see get_read_session).
+def get_session(request: Request):
+    with Session(get_engine(), info=write_session_info(request)) as session:
+        yield session
 
 
-def get_session():
-    with Session(engine) as session:
+# Create a read-only session generator function, used by the read-only routes and their user lookup
+# It uses the next healthy replica, or the primary if there is none or if the client wrote less than
+# READ_YOUR_WRITES_SECONDS ago. session.info["replica"] is True on replica sessions.
+def get_read_session(request: Request):
+    index = choose_replica(request)
+    if index is None:
+        with Session(get_engine()) as session:
+            yield session
+    else:
+        with Session(replicas.engine(index), info={"replica": True}) as session:
+            yield session
+
+
+# Create an async session generator function
+# This is the async counterpart of get_session, used by the routes in app/routes_async.py.
+async def get_async_session(request: Request):
+    async with AsyncSession(get_async_engine(), info=write_session_info(request)) as session:
         yield session
 
 
+# The async counterpart of get_read_session
+async def get_async_read_session(request: Request):
+    index = choose_replica(request)
+    if index is None:
+        async with AsyncSession(get_async_engine()) as session:
+            yield session
+    else:
+        async with AsyncSession(replicas.async_engine(index), info={"replica": True}) as session:
+            yield session
+
+
 # Function to initialize the database
 # This function creates all the tables defined in the SQLModel models.
 def init_db():
-    SQLModel.metadata.create_all(engine)
+    db_engine = get_engine()
+    new_free_ids_table = not inspect(db_engine).has_table(ProjectFreeId.__tablename__)
+    SQLModel.metadata.create_all(db_engine)
+    ensure_columns(db_engine)
+    ensure_indexes(db_engine)
+    ensure_search_indexes(db_engine)
+    with db_engine.begin() as connection:
+        sync_project_id_sequence(connection)
+        if new_free_ids_table:
+            fill_free_project_ids(connection)
+
+
+# Function to initialize the database at startup, following SCHEMA_INIT
+# In "auto" and "defer" modes, a database with a migration version table is left to the migrations.
+def init_schema():
+    if SCHEMA_INIT == "skip":
+        return
+    if SCHEMA_INIT != "create" and inspect(get_engine()).has_table(MIGRATION_VERSION_TABLE):
+        logger.info("Found %s, leaving the schema to the migrations", MIGRATION_VERSION_TABLE)
+        return
+    init_db()
+
+
+# Functions to open `count` connections of an engine and return them to its pool
+# They run in the background at startup, so the first requests find ready connections.
+def warm_pool(count: int = DB_POOL_WARMUP):
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(get_engine().connect())
+    except exc.SQLAlchemyError as e:
+        logger.warning("Could not warm up the connection pool: %s", e)
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+async def warm_async_pool(count: int = DB_POOL_WARMUP):
+    async_engine = get_async_engine()
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(await async_engine.connect())
+    except exc.SQLAlchemyError as e:
+        logger.warning("Could not warm up the async connection pool: %s", e)
+    finally:
+        await asyncio.gather(*(connection.close() for connection in connections))
+
+
+# Function to add the columns that are missing on existing tables
+# create_all only creates new tables, so columns added to a model later (with a server default, like the project
+# version) are added here with ALTER TABLE.
+def ensure_columns(db_engine):
+    inspector = inspect(db_engine)
+    for table in SQLModel.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            definition = CreateColumn(column).compile(dialect=db_engine.dialect)
+            try:
+                with db_engine.begin() as connection:
+                    table_name = db_engine.dialect.identifier_preparer.format_table(table)
+                    connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {definition}"))
+            except exc.SQLAlchemyError as e:
+                logger.warning("Could not add column %s.%s: %s", table.name, column.name, e)
+
+
+# Function to move the Postgres sequence of project IDs past the highest ID in use
+# Projects inserted with an explicit ID (gap reuse, imports with an id column) do not advance the sequence, which would
+# then hand out IDs that are taken. The sequence is read without calling nextval and only set when its next value is
+# an ID in use; a sequence that is ahead is left alone, so it never goes back over IDs handed out to running inserts.
+# Other databases assign max(id) + 1 themselves and need nothing.
+def sync_project_id_sequence(connection):
+    if connection.dialect.name != "postgresql":
+        return
+    sequence = connection.execute(text("SELECT pg_get_serial_sequence('project', 'id')")).scalar()
+    # The name returned by pg_get_serial_sequence is already quoted, so it can be used as is
+    last_value, is_called = connection.execute(text(f"SELECT last_value, is_called FROM {sequence}")).one()
+    highest = connection.execute(text("SELECT MAX(id) FROM project")).scalar()
+    next_value = last_value + 1 if is_called else last_value
+    if highest is not None and next_value <= highest:
+        connection.execute(text("SELECT setval(CAST(:sequence AS regclass), :highest)"),
+                           {"sequence": sequence, "highest": highest})
+
+
+# Function to fill ProjectFreeId with the gaps between the existing project IDs
+# It runs once, when the table is created on a database that already has projects, so the IDs freed before are
+# reused too. The gaps are read with a window function and inserted in batches.
+def fill_free_project_ids(connection, batch_size: int = 10000):
+    ids = select(Project.id.label("id"), func.lag(Project.id).over(order_by=Project.id).label("previous")).subquery()
+    gap_start = func.coalesce(ids.c.previous, 0)
+    gaps = connection.execute(select(gap_start, ids.c.id).where(ids.c.id - gap_start > 1).order_by(ids.c.id)).all()
+    free_ids = itertools.chain.from_iterable(range(previous + 1, next_used) for previous, next_used in gaps)
+    while batch := [{"id": free_id} for free_id in itertools.islice(free_ids, batch_size)]:
+        connection.execute(insert(ProjectFreeId), batch)
+
+
+# Function to create the indexes that are missing on existing tables
+# create_all only creates indexes together with new tables, so indexes added to a model later are created here.
+# A unique index that cannot be created (e.g. over duplicate values) stops the startup, because duplicate project
+# names are only rejected by these indexes (see crud.create_project). Other indexes only speed up queries, so one that
+# cannot be created is logged and skipped.
+def ensure_indexes(db_engine):
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                with db_engine.begin() as connection:
+                    connection.execute(CreateIndex(index, if_not_exists=True))
+            except exc.SQLAlchemyError as e:
+                if index.unique:
+                    raise RuntimeError(
+                        f"Could not create unique index {index.name}, remove the duplicate {table.name} first: {e}")
+                logger.warning("Could not create index %s: %s", index.name, e)
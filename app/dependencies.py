@@ -4,12 +4,21 @@ It also includes functions to enforce role-based access control (RBAC) by checki
 '''
 
 
+import os
 from fastapi import Depends, HTTPException, status
 from fastapi.security import APIKeyHeader
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
 from app.auth import decode_token
-from app.database import get_session
+from app.cache import TTLCache
+from app.config import env_flag
+from app.instrumentation import is_metrics_token, timed
+from app.database import get_engine, get_async_engine, get_session, get_async_session, get_read_session, get_async_read_session
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from app.crud import get_user_by_username
+from app import crud_async
+from app.models import User, UserPrincipal
 
 
 # This module provides dependencies for FastAPI routes, including authentication and authorization checks.
@@ -17,17 +26,79 @@ from app.crud import get_user_by_username
 oauth2_scheme = APIKeyHeader(name="Authorization")
 
 
-# This function decodes the JWT token and retrieves the user information.
-# It raises an HTTPException if the token is invalid or if the user is not found.
-def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
-    payload = decode_token(token)
+# Cache of authenticated users, keyed by user id, so most requests do not need to look the user up in the database.
+# Entries are dropped when the user is changed or deleted, and expire after USER_CACHE_TTL_SECONDS in any case.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+
+# When enabled, read-only routes trust the role claim of the (signed) token and skip the user lookup entirely.
+TRUST_TOKEN_ROLE = env_flag("TRUST_TOKEN_ROLE")
+
+
+# A function to remove a user from the authenticated-user cache.
+# It should be called whenever a user is changed or deleted; the ORM events below do it automatically.
+def invalidate_user(user_id):
+    user_cache.delete(str(user_id))
+
+
+# These event listeners invalidate the cached user as soon as the row is updated or deleted through the ORM,
+# and once more after the transaction commits, so a concurrent request cannot cache the old row in between.
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def on_user_changed(mapper, connection, target):
+    invalidate_user(target.id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_user_ids", set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def on_session_commit(session):
+    for user_id in session.info.pop("changed_user_ids", ()):
+        invalidate_user(user_id)
+
+
+# A function to decode the token of a request and return its payload.
+# It raises an HTTPException if the token is invalid or has expired.
+async def get_token_payload(token: str = Depends(oauth2_scheme)):
+    with timed("auth"):
+        payload = decode_token(token)
     if payload is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
-    user = get_user_by_username(session, payload.get("sub"))
+    return payload
+
+
+# This function decodes the JWT token and retrieves the user information.
+# It raises an HTTPException if the token is invalid or if the user is not found.
+# Write routes look the user up on the primary, with the session they write with. Read-only routes pass a replica
+# session (see get_read_only_user); a user not found there (e.g. registered a moment ago and not replicated yet) is
+# looked up again on the primary.
+def get_current_user(payload: dict = Depends(get_token_payload), session: Session = Depends(get_session)):
+    user_id = payload.get("sub")
+    principal = user_cache.get(user_id)
+    if principal is not None:
+        return principal
+
+    with timed("user"):
+        user = get_user_by_username(session, user_id)
+        if user is None and session.info.get("replica"):
+            with Session(get_engine()) as primary_session:
+                user = get_user_by_username(primary_session, user_id)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    principal = UserPrincipal(id=user.id, username=user.username, role=user.role)
+    user_cache.set(user_id, principal)
+    return principal
+
+
+# This function is used instead of get_current_user by read-only routes.
+# If TRUST_TOKEN_ROLE is enabled, the user is built from the token claims without any database or cache lookup.
+def get_read_only_user(payload: dict = Depends(get_token_payload), session: Session = Depends(get_read_session)):
+    if TRUST_TOKEN_ROLE and payload.get("sub") and payload.get("role"):
+        return UserPrincipal(id=int(payload["sub"]), role=payload["role"])
+    return get_current_user(payload, session)
 
 
 # This function checks if the user has admin privileges.
@@ -37,3 +108,44 @@ def require_admin(user=Depends(get_current_user)):
         raise HTTPException(
             status_code=403, detail="You don't have permission to perform this action. Please contact your administrator.")
     return user
+
+
+# This function checks access to /metrics: the METRICS_TOKEN, for Prometheus, or else the token of an admin.
+def require_metrics_access(token: str = Depends(oauth2_scheme), session: Session = Depends(get_read_session)):
+    if is_metrics_token(token):
+        return None
+    payload = decode_token(token)
+    if payload is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    return require_admin(get_current_user(payload, session))
+
+
+# Async versions of the dependencies above, used by the routes in app/routes_async.py.
+# They share the user cache with the sync dependencies.
+async def get_current_user_async(payload: dict = Depends(get_token_payload), session: AsyncSession = Depends(get_async_session)):
+    user_id = payload.get("sub")
+    principal = user_cache.get(user_id)
+    if principal is not None:
+        return principal
+
+    with timed("user"):
+        user = await crud_async.get_user_by_username(session, user_id)
+        if user is None and session.info.get("replica"):
+            async with AsyncSession(get_async_engine()) as primary_session:
+                user = await crud_async.get_user_by_username(primary_session, user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    principal = UserPrincipal(id=user.id, username=user.username, role=user.role)
+    user_cache.set(user_id, principal)
+    return principal
+
+
+async def get_read_only_user_async(payload: dict = Depends(get_token_payload), session: AsyncSession = Depends(get_async_read_session)):
+    if TRUST_TOKEN_ROLE and payload.get("sub") and payload.get("role"):
+        return UserPrincipal(id=int(payload["sub"]), role=payload["role"])
+    return await get_current_user_async(payload, session)
+
+
+async def require_admin_async(user=Depends(get_current_user_async)):
+    return require_admin(user)
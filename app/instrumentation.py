@@ -0,0 +1,267 @@
+'''
+Per-request timing and database query instrumentation.
+The middleware keeps the timings of the current request in a context variable; the dependencies, the JSON response
+class and the SQLAlchemy hooks in database.py add phase durations and query counts to it. Timings are sent back in a
+Server-Timing header and aggregated into Prometheus histograms per route, served at /metrics.
+Requests that run the same SQL statement many times (N+1 query patterns) are logged and counted.
+'''
+
+
+import bisect
+import contextvars
+import hmac
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+from fastapi import APIRouter
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+from app.config import env_flag
+
+
+logger = logging.getLogger(__name__)
+
+
+# Settings of the instrumentation, read from environment variables
+INSTRUMENTATION_ENABLED = env_flag("INSTRUMENTATION_ENABLED", True)
+SERVER_TIMING_ENABLED = env_flag("SERVER_TIMING_ENABLED", True)
+# A request running the same statement more than this many times is reported as an N+1 query pattern
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+# GET /metrics requires an admin token, or the header "Authorization: Bearer <METRICS_TOKEN>" when it is set
+# (for Prometheus, which cannot log in)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Histogram buckets, in seconds for durations and in queries for query counts
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+# A class representing the timings collected for one request.
+# Phase durations are in milliseconds; statements counts how often each SQL statement ran, to detect N+1 patterns.
+class RequestTimings:
+    __slots__ = ("phases", "query_count", "query_ms", "statements", "query_durations")
+
+    def __init__(self):
+        self.phases = {}
+        self.query_count = 0
+        self.query_ms = 0.0
+        self.statements = Counter()
+        self.query_durations = []
+
+    def add(self, phase: str, elapsed_ms: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + elapsed_ms
+
+    def add_query(self, statement: str, elapsed_ms: float):
+        self.query_count += 1
+        self.query_ms += elapsed_ms
+        self.statements[statement] += 1
+        self.query_durations.append(elapsed_ms)
+
+    # The Server-Timing header value, e.g. `auth;dur=0.1, db;dur=2.4;desc="3 queries", total;dur=5.0`.
+    def server_timing(self, total_ms: float) -> str:
+        entries = [f"{phase};dur={elapsed:.2f}" for phase, elapsed in self.phases.items()]
+        if self.query_count:
+            queries = "query" if self.query_count == 1 else "queries"
+            entries.append(f'db;dur={self.query_ms:.2f};desc="{self.query_count} {queries}"')
+        entries.append(f"total;dur={total_ms:.2f}")
+        return ", ".join(entries)
+
+    # The statements run more than N_PLUS_ONE_THRESHOLD times in this request.
+    def repeated_statements(self):
+        return [(statement, count) for statement, count in self.statements.items() if count > N_PLUS_ONE_THRESHOLD]
+
+
+# The timings of the request being handled; None outside requests (e.g. at startup), where nothing is recorded.
+# The object is mutable, so phases recorded in threadpool workers (sync routes) reach the same request.
+current_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar(
+    "current_timings", default=None)
+
+
+# A context manager adding the time spent in its block to a phase of the current request.
+@contextmanager
+def timed(phase: str):
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, (time.perf_counter() - start) * 1000)
+
+
+# A function to record one SQL statement of the current request; called by the engine hooks in database.py.
+def record_query(statement: str, elapsed_ms: float):
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add_query(statement, elapsed_ms)
+
+
+# A class representing a Prometheus histogram with labels, rendered in the text exposition format.
+class HistogramMetric:
+    def __init__(self, name: str, documentation: str, labels: tuple, buckets: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values: tuple, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for label_values, (counts, total, count) in sorted(series.items()):
+            labels = format_labels(self.labels, label_values)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+# A class representing a Prometheus counter with labels.
+class CounterMetric:
+    def __init__(self, name: str, documentation: str, labels: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, label_values: tuple, amount: int = 1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{{{format_labels(self.labels, label_values)}}} {value}")
+        return lines
+
+
+# A function to format label names and values as `name="value",...`, escaping the values.
+def format_labels(names: tuple, values: tuple) -> str:
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return ",".join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+# The metrics of this worker
+REQUEST_DURATION = HistogramMetric("http_request_duration_seconds", "Duration of HTTP requests.",
+                                   ("method", "route"), DURATION_BUCKETS)
+REQUESTS = CounterMetric("http_requests_total", "Number of HTTP requests.", ("method", "route", "status"))
+PHASE_DURATION = HistogramMetric("http_request_phase_duration_seconds", "Time spent in each phase of HTTP requests.",
+                                 ("method", "route", "phase"), DURATION_BUCKETS)
+QUERIES_PER_REQUEST = HistogramMetric("db_queries_per_request", "Number of SQL statements run by HTTP requests.",
+                                      ("method", "route"), QUERY_COUNT_BUCKETS)
+QUERY_DURATION = HistogramMetric("db_query_duration_seconds", "Duration of SQL statements run by HTTP requests.",
+                                 ("method", "route"), DURATION_BUCKETS)
+N_PLUS_ONE = CounterMetric("db_n_plus_one_total", "Requests that ran the same SQL statement repeatedly (N+1 pattern).",
+                           ("method", "route"))
+METRICS = [REQUEST_DURATION, REQUESTS, PHASE_DURATION, QUERIES_PER_REQUEST, QUERY_DURATION, N_PLUS_ONE]
+
+
+# A function to render every metric in the Prometheus text exposition format.
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# A function to aggregate the timings of a finished request into the metrics, and report N+1 patterns.
+def observe_request(method: str, route: str, status: int, total_ms: float, timings: RequestTimings):
+    REQUEST_DURATION.observe((method, route), total_ms / 1000)
+    REQUESTS.inc((method, route, status))
+    for phase, elapsed in timings.phases.items():
+        PHASE_DURATION.observe((method, route, phase), elapsed / 1000)
+    PHASE_DURATION.observe((method, route, "db"), timings.query_ms / 1000)
+    QUERIES_PER_REQUEST.observe((method, route), timings.query_count)
+    for elapsed in timings.query_durations:
+        QUERY_DURATION.observe((method, route), elapsed / 1000)
+
+    repeated = timings.repeated_statements()
+    if repeated:
+        N_PLUS_ONE.inc((method, route))
+        for statement, count in repeated:
+            logger.warning("Possible N+1 query pattern in %s %s: statement ran %d times: %s",
+                           method, route, count, " ".join(statement.split())[:300])
+
+
+# A class representing the ASGI middleware that times every HTTP request.
+# It is a plain ASGI middleware (not BaseHTTPMiddleware) so it adds no extra task or response buffering.
+class InstrumentationMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING_ENABLED:
+                    total_ms = (time.perf_counter() - start) * 1000
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", timings.server_timing(total_ms).encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_timings.reset(token)
+            route = scope.get("route")
+            observe_request(scope["method"], getattr(route, "path", "unmatched"), status,
+                            (time.perf_counter() - start) * 1000, timings)
+
+
+# A JSON response class that records the time spent encoding the body as the "serialize" phase.
+# It encodes with orjson, which is several times faster than the standard json module on large lists.
+class TimedJSONResponse(ORJSONResponse):
+    def render(self, content) -> bytes:
+        with timed("serialize"):
+            return super().render(content)
+
+
+# A function to check whether an Authorization header carries the METRICS_TOKEN.
+def is_metrics_token(authorization: str) -> bool:
+    return bool(METRICS_TOKEN) and hmac.compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode())
+
+
+# This router serves the metrics of this worker to Prometheus
+# It is included with the access check of app/dependencies.py (require_metrics_access).
+metrics_router = APIRouter()
+
+
+# A route or endpoint to expose the metrics in the Prometheus text format
+@metrics_router.get("/metrics", include_in_schema=False)
+def read_metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -4,9 +4,54 @@ This is a simple API that demonstrates how to implement JWT authentication and r
 '''
 
 
-from fastapi import FastAPI
+import asyncio
+import logging
+import signal
+import threading
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, Depends, FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from app.auth import PasswordHasherBusy
+from app.instrumentation import INSTRUMENTATION_ENABLED, InstrumentationMiddleware, TimedJSONResponse, metrics_router
 from app.routes import router
-from app.database import init_db
+from app.database import DATABASE_MODE, DATABASE_REPLICA_URLS, SCHEMA_INIT, ReadYourWritesMiddleware, dispose_engines, init_schema, start_replica_health_checks, warm_async_pool, warm_pool
+from app.dependencies import require_metrics_access
+
+
+logger = logging.getLogger(__name__)
+
+
+# Function to initialize the schema in the background (SCHEMA_INIT=defer) and then warm up the connection pool
+# A schema that cannot be initialized (e.g. a unique index over duplicate names) stops the server, like it would
+# without "defer", instead of serving without the constraints the writes rely on.
+def deferred_startup():
+    try:
+        init_schema()
+    except Exception:
+        logger.exception("Could not initialize the database schema, stopping the server")
+        signal.raise_signal(signal.SIGTERM)
+        return
+    warm_pool()
+
+
+# Prepare the database when the application starts, and release its connections when it stops
+# The schema is initialized according to SCHEMA_INIT (in the background with "defer"), and the connection pools are
+# warmed up in the background, so the app accepts requests as soon as possible. Read replicas are health checked
+# in the background while the app runs.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if SCHEMA_INIT == "defer":
+        threading.Thread(target=deferred_startup, name="db-startup", daemon=True).start()
+    else:
+        await run_in_threadpool(init_schema)
+        threading.Thread(target=warm_pool, name="db-warmup", daemon=True).start()
+    async_warmup = asyncio.create_task(warm_async_pool()) if DATABASE_MODE == "async" else None
+    start_replica_health_checks()
+    yield
+    if async_warmup is not None:
+        async_warmup.cancel()
+    await dispose_engines()
 
 
 # Initialize the FastAPI application and include the router for API routes
@@ -27,19 +72,40 @@ restricts access to certain endpoints based on the user’s role.
     - Admin-only project creation, updation and deletion 
     """,
     version="1.0.0",
+    default_response_class=TimedJSONResponse,
+    lifespan=lifespan,
 )
 
 
+# Send the cookie that pins the reads of a client that just wrote to the primary, whichever worker serves them
+if DATABASE_REPLICA_URLS:
+    app.add_middleware(ReadYourWritesMiddleware)
+
+
+# Time every request: phases and SQL queries are sent in a Server-Timing header and exported at /metrics.
+if INSTRUMENTATION_ENABLED:
+    app.add_middleware(InstrumentationMiddleware)
+    app.include_router(metrics_router, dependencies=[Depends(require_metrics_access)])
+
+
 # Include the router in the FastAPI application
 # This allows the application to handle requests to the defined endpoints in the router.
+# In async mode the async versions of the core routes are included first, and the sync routes they replace are left out.
+if DATABASE_MODE == "async":
+    from app.routes_async import router as async_router
+    app.include_router(async_router)
+    replaced = {(route.path, method) for route in async_router.routes for method in route.methods}
+    router = APIRouter(routes=[route for route in router.routes
+                               if not any((route.path, method) in replaced for method in route.methods)])
 app.include_router(router)
 
 
-# Initialize the database when the application starts
-# Call the init_db function to create the database tables defined in the SQLModel models.
-@app.on_event("startup")
-def on_startup():
-    init_db()
+# Return a 503 response when the password hashing pool is overloaded
+# This sheds login/register bursts early instead of letting them queue up and starve other endpoints.
+@app.exception_handler(PasswordHasherBusy)
+def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(status_code=503, content={"detail": "Server is busy, please try again shortly."},
+                        headers={"Retry-After": "1"})
 
 
 # Define a root endpoint that returns a welcome message
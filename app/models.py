@@ -5,7 +5,15 @@ These models define the structure of the database tables and the data validation
 '''
 
 from sqlmodel import SQLModel, Field
-from typing import Optional
+from sqlalchemy import Index, func, text
+from datetime import datetime
+from typing import List, Optional
+from app.config import env_flag
+
+
+# Whether project names must be unique regardless of case ("Blog" and "blog" would then clash).
+# This adds a unique index on lower(name) next to the unique index on name.
+PROJECT_NAME_CASE_INSENSITIVE = env_flag("PROJECT_NAME_CASE_INSENSITIVE")
 
 
 # A class representing a user in the database.
@@ -19,6 +27,14 @@ class User(SQLModel, table=True):
     role: str  # 'admin' or 'user'
 
 
+# A class representing the authenticated user of a request.
+# It only holds what the routes need, so it can be cached between requests instead of loading the User row every time.
+class UserPrincipal(SQLModel):
+    id: int
+    username: Optional[str] = None
+    role: str
+
+
 # A class representing a user creation request.
 # It inherits from SQLModel and defines the fields for creating a new user.
 class UserCreate(SQLModel):
@@ -43,10 +59,42 @@ class Token(SQLModel):
 
 # A class representing a project in the database.
 # It inherits from SQLModel and defines the fields for the project table.
+# The unique index on the name lets inserts and updates detect duplicates through the constraint, in the same round trip.
 class Project(SQLModel, table=True):
+    __table_args__ = (
+        (Index("ix_project_name_lower", func.lower(text("name")), unique=True),)
+        if PROJECT_NAME_CASE_INSENSITIVE else ()
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    name: str
+    name: str = Field(index=True, unique=True)
     description: str
+    # Incremented on every update, it is the ETag of the project and lets updates detect concurrent changes
+    version: int = Field(default=1, sa_column_kwargs={"server_default": text("1")})
+
+
+# A class representing a project ID freed by a deletion, kept to be reused by the "gap" ID strategy
+# (see crud.allocate_project_ids). Taking the lowest one is a single lookup at the start of the primary key index.
+class ProjectFreeId(SQLModel, table=True):
+    __tablename__ = "project_free_id"
+
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+
+
+# A class representing an entry of the append-only log of project changes, read by GET /projects/changes.
+# `operation` is 'create', 'update' or 'delete', with the state of the project after the change (none for 'delete'),
+# or 'reload' after a bulk import, which is not logged row by row: consumers should then read the whole list again.
+# Entries are ordered by `seq`; changed_at is in UTC.
+class ProjectChange(SQLModel, table=True):
+    __tablename__ = "project_change"
+
+    seq: Optional[int] = Field(default=None, primary_key=True)
+    operation: str
+    project_id: Optional[int] = None
+    name: Optional[str] = None
+    description: Optional[str] = None
+    version: Optional[int] = None
+    changed_at: datetime
 
 
 # A class representing a project creation request.
@@ -54,3 +102,26 @@ class Project(SQLModel, table=True):
 class ProjectCreate(SQLModel):
     name: str
     description: str
+
+
+# A class representing a partial update of a project.
+# Only the fields that are set are changed.
+class ProjectUpdate(SQLModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+
+
+# A class representing one operation of a batch request on projects.
+# `op` is 'create', 'update' or 'delete'; create needs a name and description, update and delete need the project id.
+class ProjectOperation(SQLModel):
+    op: str
+    id: Optional[int] = None
+    name: Optional[str] = None
+    description: Optional[str] = None
+
+
+# A class representing a batch request on projects.
+# With `atomic`, the batch is rejected as a whole if any operation is invalid.
+class ProjectBatch(SQLModel):
+    operations: List[ProjectOperation]
+    atomic: bool = False
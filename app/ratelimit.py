@@ -0,0 +1,166 @@
+'''
+Rate limiting of the authentication endpoints.
+Login attempts are limited per client IP and failed logins per username, and registrations per client IP, with a
+sliding window counter. Over-limit requests are rejected with 429 before any database lookup or bcrypt work, so a
+credential stuffing burst cannot turn into CPU exhaustion. Counters are kept in memory, or in Redis (RATE_LIMIT_URL)
+to share them between workers.
+'''
+
+
+import hashlib
+import math
+import os
+import threading
+import time
+from typing import List, Optional
+from fastapi import HTTPException, Request
+from app.cache import TTLCache
+from app.config import env_flag
+
+
+# Limits, as "<requests>/<seconds>"; an empty value disables a limit
+RATE_LIMIT_ENABLED = env_flag("RATE_LIMIT_ENABLED", True)
+RATE_LIMIT_LOGIN_PER_IP = os.getenv("RATE_LIMIT_LOGIN_PER_IP", "30/60")
+RATE_LIMIT_LOGIN_FAILURES_PER_USERNAME = os.getenv("RATE_LIMIT_LOGIN_FAILURES_PER_USERNAME", "10/300")
+RATE_LIMIT_REGISTER_PER_IP = os.getenv("RATE_LIMIT_REGISTER_PER_IP", "10/600")
+# Shared counters: a Redis URL (e.g. redis://localhost:6379/1); when empty, every worker counts on its own
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL")
+# Maximum number of counters kept in memory; the least recently used ones are dropped first
+RATE_LIMIT_CACHE_SIZE = int(os.getenv("RATE_LIMIT_CACHE_SIZE", "100000"))
+
+
+# A class representing an in-process store of rate limit counters, which expire on their own.
+class LocalRateLimitStore:
+    def __init__(self, maxsize: int):
+        self.counters = TTLCache(maxsize=maxsize, ttl=60)
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: List[str]) -> List[int]:
+        return [self.counters.get(key) or 0 for key in keys]
+
+    def incr(self, key: str, ttl: float):
+        with self._lock:
+            self.counters.set(key, (self.counters.get(key) or 0) + 1, ttl=ttl)
+
+
+# A class representing a store of rate limit counters in Redis, shared by every worker.
+# It takes any client with the mget/pipeline methods of redis-py.
+class RedisRateLimitStore:
+    def __init__(self, client):
+        self.client = client
+
+    def get_many(self, keys: List[str]) -> List[int]:
+        return [int(value or 0) for value in self.client.mget(keys)]
+
+    def incr(self, key: str, ttl: float):
+        pipeline = self.client.pipeline()
+        pipeline.incr(key)
+        pipeline.expire(key, max(1, math.ceil(ttl)))
+        pipeline.execute()
+
+
+# A function to create the counter store: in memory when url is empty, Redis otherwise.
+# The redis package is only needed when a Redis URL is configured.
+def create_rate_limit_store(url: Optional[str], maxsize: int):
+    if not url:
+        return LocalRateLimitStore(maxsize)
+    import redis
+    return RedisRateLimitStore(redis.Redis.from_url(url))
+
+
+# A class representing a sliding window rate limit of `limit` events per `period` seconds for each key.
+# It keeps one counter per key and fixed window, and estimates the count over the last `period` seconds by weighting
+# the previous window with the part of it that is still inside the sliding window.
+class SlidingWindowLimiter:
+    def __init__(self, store, name: str, rate: str):
+        self.store = store
+        self.name = name
+        self.limit, self.period = parse_rate(rate)
+
+    def _keys(self, key: str, window: int):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+        return [f"ratelimit:{self.name}:{digest}:{window - 1}", f"ratelimit:{self.name}:{digest}:{window}"]
+
+    # Returns how many seconds to wait before the next event for key is allowed, or None if it is allowed now.
+    def retry_after(self, key: str) -> Optional[float]:
+        if not self.limit:
+            return None
+        now = time.time()
+        window = int(now // self.period)
+        elapsed = now - window * self.period
+        previous, current = self.store.get_many(self._keys(key, window))
+        if previous * (1 - elapsed / self.period) + current < self.limit:
+            return None
+        if current >= self.limit:
+            return self.period - elapsed
+        # Wait until enough of the previous window has slid out
+        return max(self.period * (1 - (self.limit - current) / previous) - elapsed, 0.0)
+
+    # Counts an event for key.
+    def record(self, key: str):
+        if self.limit:
+            window = int(time.time() // self.period)
+            self.store.incr(self._keys(key, window)[1], ttl=2 * self.period)
+
+    # Counts an event for key if it is allowed; returns the seconds to wait otherwise (and does not count it).
+    def hit(self, key: str) -> Optional[float]:
+        wait = self.retry_after(key)
+        if wait is None:
+            self.record(key)
+        return wait
+
+
+# A function to parse a rate such as "30/60" into (30, 60.0); an empty rate means no limit.
+def parse_rate(rate: str):
+    if not rate:
+        return 0, 1.0
+    limit, _, period = rate.partition("/")
+    return int(limit), float(period or 1)
+
+
+store = create_rate_limit_store(RATE_LIMIT_URL, RATE_LIMIT_CACHE_SIZE)
+login_ip_limiter = SlidingWindowLimiter(store, "login-ip", RATE_LIMIT_LOGIN_PER_IP)
+login_failure_limiter = SlidingWindowLimiter(store, "login-failure", RATE_LIMIT_LOGIN_FAILURES_PER_USERNAME)
+register_ip_limiter = SlidingWindowLimiter(store, "register-ip", RATE_LIMIT_REGISTER_PER_IP)
+
+
+# A function to return the IP address of the client of a request.
+# Behind a proxy, run uvicorn with --proxy-headers and --forwarded-allow-ips listing the proxies (app.serve does, see
+# FORWARDED_ALLOW_IPS): uvicorn then sets the client to the right-most X-Forwarded-For entry that is not a trusted
+# proxy, which a client cannot forge by sending its own header. Do not trust "*", which takes the first entry.
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+
+# A function to raise the 429 response of a rejected request.
+def too_many_requests(wait: float):
+    raise HTTPException(status_code=429, detail="Too many attempts. Please try again later.",
+                        headers={"Retry-After": str(max(1, math.ceil(wait)))})
+
+
+# A function to check the login limits before the credentials are verified.
+# Every attempt counts against the client IP; only failures count against the username (see record_failed_login),
+# so a user logging in normally is never locked out.
+def throttle_login(request: Request, username: str):
+    if not RATE_LIMIT_ENABLED:
+        return
+    wait = login_failure_limiter.retry_after(username)
+    if wait is None:
+        wait = login_ip_limiter.hit(client_ip(request))
+    if wait is not None:
+        too_many_requests(wait)
+
+
+# A function to count a failed login against the username, whether or not the user exists.
+def record_failed_login(username: str):
+    if RATE_LIMIT_ENABLED:
+        login_failure_limiter.record(username)
+
+
+# A function to check the registration limit of the client IP.
+def throttle_register(request: Request):
+    if not RATE_LIMIT_ENABLED:
+        return
+    wait = register_ip_limiter.hit(client_ip(request))
+    if wait is not None:
+        too_many_requests(wait)
@@ -4,27 +4,139 @@ It uses FastAPI to create the endpoints and SQLModel for database interactions.
 '''
 
 
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import csv
+import io
+import os
+import time
+import orjson
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlmodel import Session
-from app.models import UserCreate, UserLogin, Token, ProjectCreate, Project
-from app.auth import create_access_token
-from app.crud import create_user, authenticate_user, create_project, get_projects
-from app.dependencies import get_current_user, require_admin
-from app.database import get_session
+from app.models import UserCreate, UserLogin, Token, ProjectCreate, ProjectUpdate, ProjectBatch
+from app.auth import create_access_token, token_cache
+from app.crud import create_user, authenticate_user, create_project, get_projects, apply_project_batch, search_projects, get_project, update_project as update_project_row, delete_project as delete_project_row, get_project_changes, iter_project_batches, projects_cache, projects_cache_key, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, PROJECT_FIELDS, VERSION_CONFLICT_DETAIL
+from app.dependencies import get_read_only_user, require_admin, user_cache
+from app.database import REPLICA_STALE_SECONDS, get_session, get_read_session, get_read_engine, get_async_engine, get_engine, pool_stats, replicas
+from app.instrumentation import TimedJSONResponse, current_timings, timed
+from app.ratelimit import record_failed_login, throttle_login, throttle_register
 
 
 # This router will be included in the main FastAPI app
 router = APIRouter()
 
 
+# Media types of the formats supported by the projects export endpoint
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# Settings of the project change stream: how often it checks for new changes, how often it sends a keep-alive comment
+# when there are none, and after how long it ends (clients reconnect on their own, from the last change they received)
+CHANGE_STREAM_POLL_SECONDS = float(os.getenv("CHANGE_STREAM_POLL_SECONDS", "1"))
+CHANGE_STREAM_KEEPALIVE_SECONDS = float(os.getenv("CHANGE_STREAM_KEEPALIVE_SECONDS", "15"))
+CHANGE_STREAM_MAX_SECONDS = float(os.getenv("CHANGE_STREAM_MAX_SECONDS", "300"))
+
+
+# A generator that encodes every project in the requested export format, one batch at a time.
+# It opens its own session because the response body is streamed after the request dependencies have been closed.
+def stream_projects_export(export_format: str, db_engine):
+    with Session(db_engine) as session:
+        if export_format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(PROJECT_FIELDS)
+            yield buffer.getvalue()
+            for rows in iter_project_batches(session):
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows(rows)
+                yield buffer.getvalue()
+        else:
+            for rows in iter_project_batches(session):
+                yield b"".join(orjson.dumps(dict(zip(PROJECT_FIELDS, row)), option=orjson.OPT_APPEND_NEWLINE)
+                               for row in rows)
+
+
+# A generator that sends the project changes logged after `since` as Server-Sent Events, then the new ones as they
+# are logged. Every event carries the `seq` of its change as its id, so a reconnecting client resumes from there.
+# Each check for new changes opens a short session, so an idle stream does not hold a database connection.
+# The checks are left out of the request timings: a stream repeats the same query for minutes, which is not an N+1 pattern.
+async def stream_project_changes(request: Request, since: int, db_engine):
+    def read_changes(since: int):
+        current_timings.set(None)
+        with Session(db_engine) as session:
+            return get_project_changes(session, since, limit=MAX_PAGE_SIZE)
+
+    yield f"retry: {int(CHANGE_STREAM_POLL_SECONDS * 1000)}\n\n".encode()
+    deadline = time.monotonic() + CHANGE_STREAM_MAX_SECONDS
+    last_sent = time.monotonic()
+    while time.monotonic() < deadline and not await request.is_disconnected():
+        page = await run_in_threadpool(read_changes, since)
+        if page["changes"]:
+            yield b"".join(b"id: %d\nevent: change\ndata: %s\n\n" % (change["seq"], orjson.dumps(change))
+                           for change in page["changes"])
+            since = page["next_since"]
+            last_sent = time.monotonic()
+            if page["has_more"]:
+                continue
+        elif time.monotonic() - last_sent >= CHANGE_STREAM_KEEPALIVE_SECONDS:
+            yield b": keep-alive\n\n"
+            last_sent = time.monotonic()
+        await asyncio.sleep(CHANGE_STREAM_POLL_SECONDS)
+
+
+# A function to tell whether a page read with session can be stored in the shared response cache.
+# Pages read from a replica shortly after a write may predate it, so they are returned but not cached.
+def is_cacheable(session) -> bool:
+    return not session.info.get("replica") or not projects_cache.changed_within(REPLICA_STALE_SECONDS)
+
+
+# A function to build the response of a cached JSON body.
+# It answers 304 Not Modified with no body if the client already has this version (If-None-Match matches the ETag).
+def etag_response(request: Request, etag: str, body: bytes) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = {candidate.strip()[2:] if candidate.strip().startswith("W/") else candidate.strip()
+                      for candidate in if_none_match.split(",")}
+        if etag in candidates or "*" in candidates:
+            return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# A function to build the ETag of a project, from its version.
+def project_etag(project: dict) -> str:
+    return f'"{project["version"]}"'
+
+
+# A function to read the project version required by an If-Match header; None when any version is accepted.
+# A header that cannot match any version (e.g. a weak or malformed ETag) fails with 412 Precondition Failed.
+def if_match_version(if_match: Optional[str]) -> Optional[int]:
+    if if_match is None or if_match.strip() == "*":
+        return None
+    value = if_match.strip()
+    if len(value) > 2 and value[0] == value[-1] == '"' and value[1:-1].isdigit():
+        return int(value[1:-1])
+    raise HTTPException(status_code=412, detail=VERSION_CONFLICT_DETAIL)
+
+
+# A function to build the response of a project update, with the new ETag of the project.
+def project_update_response(project: dict, changed: bool) -> Response:
+    detail = "Project updated successfully" if changed else "You have not made any changes to update the project details"
+    return TimedJSONResponse({"detail": detail, "project": project}, headers={"ETag": project_etag(project)})
+
+
 # A route or endpoint to register a new user
 @router.post("/register", summary="Register a new user",
              description="""  
     Creates a new user in the system.  
     - Requires a valid `username`, `password`, and `role`.  
     - Returns the created user details.  
+    - Registrations are rate limited per client IP (`429 Too Many Requests` with a `Retry-After` header).  
     """)
-def register(user_data: UserCreate, session: Session = Depends(get_session)):
+def register(request: Request, user_data: UserCreate, session: Session = Depends(get_session)):
+    throttle_register(request)
     return create_user(session, user_data)
 
 
@@ -35,27 +147,136 @@ def register(user_data: UserCreate, session: Session = Depends(get_session)):
     Authenticates a user and returns a JWT token.  
     - Requires a valid `username` and `password`.  
     - Returns an access token for authentication.  
+    - Attempts are rate limited per client IP, and failed attempts per username (`429 Too Many Requests` with a `Retry-After` header).  
     """)
-def login(credentials: UserLogin, session: Session = Depends(get_session)):
+def login(request: Request, credentials: UserLogin, session: Session = Depends(get_session)):
+    throttle_login(request, credentials.username)
     user = authenticate_user(
         session, credentials.username, credentials.password)
     if not user:
+        record_failed_login(credentials.username)
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = create_access_token(data={"sub": str(user.id), "role": user.role})
     return {"access_token": token}
 
 
 # A route or endpoint to get all projects
-# This route uses the get_projects function to retrieve all projects from the database
+# This route uses the get_projects function to retrieve one page of projects from the database
 @router.get("/projects", summary="List all projects",
             description="""  
-    Returns a list of all projects. Both admin and user roles can access this endpoint.  
+    Returns a page of projects. Both admin and user roles can access this endpoint.  
+    Responses carry an `ETag`: send it back in `If-None-Match` to get a `304 Not Modified` while the list is unchanged.  
     - **sort_by**: Sort order (`asc` or `desc`).  
+    - **limit**: Maximum number of projects to return in one page.  
+    - **cursor**: The `next_cursor` value of the previous page, to fetch the next one.  
+    - **fields**: Comma separated list of fields to return (e.g. `id,name`). The `id` is always returned.  
+    - Requires authentication.  
+    """,
+            )
+def read_projects(
+    request: Request,
+    session: Session = Depends(get_read_session),
+    user=Depends(get_read_only_user),
+    sort_by: str = "desc",
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    slot = projects_cache.slot(projects_cache_key(sort_by, limit, cursor, fields))
+    cached = projects_cache.get(slot)
+    if cached is None:
+        page = get_projects(session, sort_by=sort_by, limit=limit, cursor=cursor, fields=fields)
+        with timed("serialize"):
+            body = orjson.dumps(page)
+        cached = projects_cache.set(slot, body, store=is_cacheable(session))
+    return etag_response(request, *cached)
+
+
+# A route or endpoint to search projects
+# This route matches the query against the name and description of projects and returns the best matches first
+@router.get("/projects/search", summary="Search projects",
+            description="""  
+    Searches projects by name and description, best matches first. Both admin and user roles can access this endpoint.  
+    - **q**: Search terms. Words match by prefix (e.g. `chat` matches `Chatbot`), and names with small typos still match.  
+    - **limit**: Maximum number of projects to return in one page.  
+    - **cursor**: The `next_cursor` value of the previous page, to fetch the next one.  
+    - Requires authentication.  
+    """,
+            )
+def search_projects_route(
+    q: str,
+    session: Session = Depends(get_read_session),
+    user=Depends(get_read_only_user),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    return TimedJSONResponse(search_projects(session, q, limit=limit, cursor=cursor))
+
+
+# A route or endpoint to export all projects
+# This route streams the whole Project table in batches instead of building the full result set in memory
+@router.get("/projects/export", summary="Export all projects",
+            description="""  
+    Streams every project, ordered by ID. Both admin and user roles can access this endpoint.  
+    - **format**: Export format (`ndjson` or `csv`).  
+    - Requires authentication.  
+    """,
+            )
+def export_projects(request: Request, user=Depends(get_read_only_user), export_format: str = Query("ndjson", alias="format")):
+    if export_format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=400, detail="Invalid export format. Use 'ndjson' or 'csv'.")
+    return StreamingResponse(
+        stream_projects_export(export_format, get_read_engine(request)),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f"attachment; filename=projects.{export_format}"}
+    )
+
+
+# A route or endpoint to get the changes made to projects since a point of the change log
+# Consumers keep the returned next_since and pass it back, so they only fetch what changed instead of the whole list
+@router.get("/projects/changes", summary="Get project changes",
+            description="""  
+    Returns the changes made to projects after the change `since`, oldest first. Both admin and user roles can access this endpoint.  
+    - **since**: The `next_since` value of the previous call, or `0` to read the log from the start.  
+    - **limit**: Maximum number of changes to return; `has_more` tells whether more changes are already available.  
+    - Each change has its `seq`, its `op` (`create`, `update` or `delete`) and the project after the change (`null` for `delete`).  
+    - An `op` of `reload` means projects were imported in bulk without being logged one by one: read the whole list again.  
     - Requires authentication.  
     """,
             )
-def read_projects(session: Session = Depends(get_session), user=Depends(get_current_user), sort_by: str = "desc"):
-    return get_projects(session, sort_by=sort_by)
+def read_project_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    session: Session = Depends(get_read_session),
+    user=Depends(get_read_only_user)
+):
+    return TimedJSONResponse(get_project_changes(session, since, limit=limit))
+
+
+# A route or endpoint to stream the changes made to projects as Server-Sent Events
+@router.get("/projects/changes/stream", summary="Stream project changes",
+            description="""  
+    Streams the changes made to projects after the change `since` as Server-Sent Events (`text/event-stream`), then every new change as it happens. Both admin and user roles can access this endpoint.  
+    - **since**: The `seq` of the last change already received, or `0` to stream the log from the start. The `Last-Event-ID` header sent by reconnecting clients takes precedence.  
+    - Each `change` event has the `seq` of the change as its id, and the change (as returned by `GET /projects/changes`) as its data.  
+    - The stream ends after a few minutes; clients reconnect and resume from the last change they received.  
+    - Requires authentication.  
+    """,
+            )
+def stream_project_changes_route(
+    request: Request,
+    since: int = Query(0, ge=0),
+    last_event_id: Optional[str] = Header(None),
+    user=Depends(get_read_only_user)
+):
+    if last_event_id is not None and last_event_id.isdigit():
+        since = int(last_event_id)
+    return StreamingResponse(
+        stream_project_changes(request, since, get_read_engine(request)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 # A route or endpoint to create a new project
@@ -70,8 +291,25 @@ def add_project(project: ProjectCreate, session: Session = Depends(get_session),
     return {"detail": "Project created successfully", "project": create_project(session, project)}
 
 
+# A route or endpoint to create, update and delete many projects in one request
+# This route validates the whole batch with set-based queries and writes it in a single transaction
+@router.post("/projects:batch", summary="Create, update or delete projects in bulk",
+             description="""  
+    Applies a list of operations on projects in a single transaction.  
+    - Each operation has an `op` (`create`, `update` or `delete`); `create` needs a `name` and `description`, `update` and `delete` need the project `id`.  
+    - Returns one result per operation, in order, with its status and the project ID.  
+    - Invalid operations are skipped and reported, unless `atomic` is true, in which case nothing is applied.  
+    - Requires admin authentication.  
+    """)
+def batch_projects(batch: ProjectBatch, session: Session = Depends(get_session), user=Depends(require_admin)):
+    results = apply_project_batch(session, batch.operations, atomic=batch.atomic)
+    failed = sum(1 for result in results if result["status"] >= 400)
+    return TimedJSONResponse(
+        {"detail": f"{len(results) - failed} operations applied, {failed} failed", "results": results})
+
+
 # A route or endpoint to get a specific project by its ID and delete it
-# This route uses the Project model to validate the project data and returns the deleted project with a success message
+# This route deletes the project with a single statement and returns the deleted project with a success message
 @router.delete("/projects/{project_id}", summary="Delete a project",
                description="""  
     Deletes a specific project by its ID.  
@@ -84,12 +322,25 @@ def delete_project(
     session: Session = Depends(get_session),
     user=Depends(require_admin)
 ):
-    project = session.get(Project, project_id)
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found")
-    session.delete(project)
-    session.commit()
-    return {"detail": "Project deleted successfully", "project": project}
+    return {"detail": "Project deleted successfully", "project": delete_project_row(session, project_id)}
+
+
+# A route or endpoint to get a specific project by its ID
+# The response carries the ETag of the project, to send back in If-Match when updating it
+@router.get("/projects/{project_id}", summary="Get a project",
+            description="""  
+    Returns a specific project by its ID. Both admin and user roles can access this endpoint.  
+    - The `ETag` header identifies the version of the project: send it in `If-Match` to update the project only if nobody changed it since.  
+    - Requires authentication.  
+    """)
+def read_project(
+    request: Request,
+    project_id: int,
+    session: Session = Depends(get_read_session),
+    user=Depends(get_read_only_user)
+):
+    project = get_project(session, project_id)
+    return etag_response(request, project_etag(project), orjson.dumps(project))
 
 
 # A route or endpoint to update a specific project by its ID
@@ -98,27 +349,67 @@ def delete_project(
             description="""  
     Updates a specific project by its ID.  
     - Requires a valid `project_id`.  
+    - Send the project `ETag` in `If-Match` to only update it if nobody changed it since; otherwise `412 Precondition Failed` is returned.  
+    - Fields left to the placeholder value `"string"` are not changed; prefer `PATCH` to update only some fields.  
     - Requires admin authentication.  
-    - Returns a success message with the updated project details.  
+    - Returns a success message with the updated project details and its new `ETag`.  
     """)
 def update_project(
     project_id: int,
     updated: ProjectCreate,
+    if_match: Optional[str] = Header(None),
+    session: Session = Depends(get_session),
+    user=Depends(require_admin)
+):
+    changes = {field: value for field, value in updated.model_dump().items() if value != "string"}
+    project = update_project_row(session, project_id, changes, if_match_version(if_match))
+    return project_update_response(project, bool(changes))
+
+
+# A route or endpoint to partially update a specific project by its ID
+# This route uses the ProjectUpdate model: only the fields present in the body are changed
+@router.patch("/projects/{project_id}", summary="Partially update a project",
+              description="""  
+    Updates some fields of a specific project by its ID; fields left out of the body are not changed.  
+    - Send the project `ETag` in `If-Match` to only update it if nobody changed it since; otherwise `412 Precondition Failed` is returned.  
+    - Requires admin authentication.  
+    - Returns a success message with the updated project details and its new `ETag`.  
+    """)
+def patch_project(
+    project_id: int,
+    updated: ProjectUpdate,
+    if_match: Optional[str] = Header(None),
     session: Session = Depends(get_session),
     user=Depends(require_admin)
 ):
-    project = session.get(Project, project_id)
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found")
-    if updated.name != "string" and updated.name != project.name:
-        project.name = updated.name
-    if updated.description != "string" and updated.description != project.description:
-        project.description = updated.description
-
-    if updated.name == "string" and updated.description == "string":
-        return {"detail": "You have not made any changes to update the project details", "project": project}
-
-    session.add(project)
-    session.commit()
-    session.refresh(project)
-    return {"detail": "Project updated successfully", "project": project}
+    changes = updated.model_dump(exclude_none=True)
+    project = update_project_row(session, project_id, changes, if_match_version(if_match))
+    return project_update_response(project, bool(changes))
+
+
+# A route or endpoint to get the hit/miss counters of the in-process caches
+# This route can be used to check how effective the caches are and to size them
+@router.get("/stats/cache", summary="Cache statistics",
+            description="""  
+    Returns the size and hit/miss counters of the in-process caches of this worker.  
+    - Requires admin authentication.  
+    """)
+def read_cache_stats(user=Depends(require_admin)):
+    return {"token_cache": token_cache.stats(), "user_cache": user_cache.stats(), "projects_cache": projects_cache.stats()}
+
+
+# A route or endpoint to get the state of the database connection pools
+# This route reports connections in use, overflow and checkout wait times, to size the pools from real numbers
+@router.get("/stats/pool", summary="Connection pool statistics",
+            description="""  
+    Returns the size, usage and checkout wait times of the database connection pools of this worker, and the health of the read replicas.  
+    - Requires admin authentication.  
+    """)
+def read_pool_stats(user=Depends(require_admin)):
+    stats = {"engine": pool_stats(get_engine())}
+    async_engine = get_async_engine()
+    if async_engine is not None:
+        stats["async_engine"] = pool_stats(async_engine.sync_engine)
+    if replicas.urls:
+        stats["replicas"] = replicas.stats()
+    return stats
@@ -0,0 +1,118 @@
+'''
+This module defines async versions of the core API routes, used when DATABASE_MODE is "async".
+They run on the event loop with an AsyncSession instead of in the threadpool, so a single worker can serve many
+concurrent requests. Their summary and description are taken from the matching routes in app/routes.py.
+'''
+
+
+from typing import Optional
+import orjson
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app import crud_async
+from app.models import UserCreate, UserLogin, Token, ProjectCreate, ProjectUpdate
+from app.auth import create_access_token
+from app.crud import projects_cache, projects_cache_key, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.dependencies import get_read_only_user_async, require_admin_async
+from app.database import get_async_session, get_async_read_session
+from app.instrumentation import timed
+from app.ratelimit import record_failed_login, throttle_login, throttle_register
+from app.routes import router as sync_router, etag_response, if_match_version, is_cacheable, project_update_response
+
+
+# This router will be included in the main FastAPI app instead of the matching sync routes
+router = APIRouter()
+
+
+# A function to get the summary and description of the sync route with the same path and method,
+# so the API documentation is the same in both modes.
+def docs_of(path: str, method: str) -> dict:
+    for route in sync_router.routes:
+        if route.path == path and method in route.methods:
+            return {"summary": route.summary, "description": route.description}
+    return {}
+
+
+# A route or endpoint to register a new user
+@router.post("/register", **docs_of("/register", "POST"))
+async def register(request: Request, user_data: UserCreate, session: AsyncSession = Depends(get_async_session)):
+    throttle_register(request)
+    return await crud_async.create_user(session, user_data)
+
+
+# A route or endpoint to login a user and return a JWT token
+@router.post("/login", response_model=Token, **docs_of("/login", "POST"))
+async def login(request: Request, credentials: UserLogin, session: AsyncSession = Depends(get_async_session)):
+    throttle_login(request, credentials.username)
+    user = await crud_async.authenticate_user(
+        session, credentials.username, credentials.password)
+    if not user:
+        record_failed_login(credentials.username)
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    token = create_access_token(data={"sub": str(user.id), "role": user.role})
+    return {"access_token": token}
+
+
+# A route or endpoint to get a page of projects
+@router.get("/projects", **docs_of("/projects", "GET"))
+async def read_projects(
+    request: Request,
+    session: AsyncSession = Depends(get_async_read_session),
+    user=Depends(get_read_only_user_async),
+    sort_by: str = "desc",
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    slot = projects_cache.slot(projects_cache_key(sort_by, limit, cursor, fields))
+    cached = projects_cache.get(slot)
+    if cached is None:
+        page = await crud_async.get_projects(session, sort_by=sort_by, limit=limit, cursor=cursor, fields=fields)
+        with timed("serialize"):
+            body = orjson.dumps(page)
+        cached = projects_cache.set(slot, body, store=is_cacheable(session))
+    return etag_response(request, *cached)
+
+
+# A route or endpoint to create a new project
+@router.post("/projects", **docs_of("/projects", "POST"))
+async def add_project(project: ProjectCreate, session: AsyncSession = Depends(get_async_session), user=Depends(require_admin_async)):
+    return {"detail": "Project created successfully", "project": await crud_async.create_project(session, project)}
+
+
+# A route or endpoint to get a specific project by its ID and delete it
+@router.delete("/projects/{project_id}", **docs_of("/projects/{project_id}", "DELETE"))
+async def delete_project(
+    project_id: int,
+    session: AsyncSession = Depends(get_async_session),
+    user=Depends(require_admin_async)
+):
+    return {"detail": "Project deleted successfully", "project": await crud_async.delete_project(session, project_id)}
+
+
+# A route or endpoint to update a specific project by its ID
+@router.put("/projects/{project_id}", **docs_of("/projects/{project_id}", "PUT"))
+async def update_project(
+    project_id: int,
+    updated: ProjectCreate,
+    if_match: Optional[str] = Header(None),
+    session: AsyncSession = Depends(get_async_session),
+    user=Depends(require_admin_async)
+):
+    changes = {field: value for field, value in updated.model_dump().items() if value != "string"}
+    project = await crud_async.update_project(session, project_id, changes, if_match_version(if_match))
+    return project_update_response(project, bool(changes))
+
+
+# A route or endpoint to partially update a specific project by its ID
+@router.patch("/projects/{project_id}", **docs_of("/projects/{project_id}", "PATCH"))
+async def patch_project(
+    project_id: int,
+    updated: ProjectUpdate,
+    if_match: Optional[str] = Header(None),
+    session: AsyncSession = Depends(get_async_session),
+    user=Depends(require_admin_async)
+):
+    changes = updated.model_dump(exclude_none=True)
+    project = await crud_async.update_project(session, project_id, changes, if_match_version(if_match))
+    return project_update_response(project, bool(changes))
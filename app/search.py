@@ -0,0 +1,185 @@
+'''
+Full-text and prefix search over projects.
+On Postgres, searches run in the database: a GIN index over the name and description tsvector answers full-text and
+prefix matches, and a trigram GIN index on the name answers fuzzy matches against the words of the name. Other databases (e.g. SQLite in tests)
+use an in-process inverted index over the same fields, so the feature behaves the same way offline.
+'''
+
+
+import bisect
+import logging
+import re
+import threading
+from typing import List, Tuple
+from sqlalchemy import Double, cast, func, literal, literal_column, or_, text
+from sqlmodel import Session, select
+from app.models import Project
+
+
+logger = logging.getLogger(__name__)
+
+
+# Minimum trigram similarity between the query and a word of the name for a fuzzy match. It is lower than the
+# pg_trgm default for word similarity (0.6), so a word with a typo or two still matches ("wether" finds "Weather").
+SIMILARITY_THRESHOLD = 0.3
+
+
+# A function to split text into lowercase search tokens.
+def tokenize(value: str) -> List[str]:
+    return re.findall(r"\w+", value.lower())
+
+
+# The tsvector searched on Postgres; the GIN index below is built over this exact expression so it can be used.
+project_document = func.to_tsvector(
+    literal_column("'simple'"), Project.name + literal_column("' '") + Project.description)
+
+# Postgres indexes used by search: full-text over name and description, and trigrams of the name.
+# They are created with plain DDL rather than declared on the model, because SQLite cannot create them.
+SEARCH_INDEXES = {
+    "ix_project_search_document":
+        "CREATE INDEX IF NOT EXISTS ix_project_search_document ON project "
+        "USING gin (to_tsvector('simple', name || ' ' || description))",
+    "ix_project_name_trgm":
+        "CREATE INDEX IF NOT EXISTS ix_project_name_trgm ON project USING gin (name gin_trgm_ops)",
+}
+
+
+# Function to create the search indexes on Postgres
+# Search needs the pg_trgm extension; enabling it requires extra privileges, so failures are logged for an administrator to fix.
+def ensure_search_indexes(db_engine):
+    if db_engine.dialect.name != "postgresql":
+        return
+    statements = {"pg_trgm": "CREATE EXTENSION IF NOT EXISTS pg_trgm", **SEARCH_INDEXES}
+    for name, statement in statements.items():
+        try:
+            with db_engine.begin() as connection:
+                connection.execute(text(statement))
+        except Exception as e:
+            logger.warning("Could not create %s: %s", name, e)
+
+
+# A function to build the Postgres query matching projects against a search string.
+# Every token must match a word of the name or description by prefix (e.g. "chat bo" matches "Chatbot"),
+# or the query must be similar enough to words of the name (typos). It returns (id, name, description, score) rows.
+# The query is compared with the best matching words rather than the whole name, which would dilute the similarity
+# of a one-word query with the rest of the name; run similarity_threshold_query first in the same transaction.
+# The score is cast to double precision: ts_rank and word_similarity return reals, which never equal the float
+# carried back by the page cursors, so projects tied on score would be skipped or repeated across pages.
+def postgres_search_query(q: str):
+    tokens = tokenize(q)
+    prefix_query = func.to_tsquery(literal_column("'simple'"), " & ".join(f"{token}:*" for token in tokens))
+    score = cast(func.ts_rank(project_document, prefix_query) + func.word_similarity(q, Project.name), Double)
+    score = score.label("score")
+    return select(Project.id, Project.name, Project.description, score).where(
+        or_(project_document.op("@@")(prefix_query), literal(q).op("<%")(Project.name)))
+
+
+# A function to build the statement setting the threshold of the `<%` operator to SIMILARITY_THRESHOLD
+# for the rest of the current transaction.
+def similarity_threshold_query():
+    return select(func.set_config("pg_trgm.word_similarity_threshold", str(SIMILARITY_THRESHOLD), True))
+
+
+# A function to compute the trigrams of a string, the way pg_trgm does (each word padded with spaces).
+def trigrams(value: str) -> set:
+    grams = set()
+    for word in tokenize(value):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+# A function to compute the similarity of two trigram sets, the way pg_trgm does.
+def jaccard(first: set, second: set) -> float:
+    union = len(first | second)
+    return len(first & second) / union if union else 0.0
+
+
+# A class representing an in-process inverted index of projects, used when the database has no full-text search.
+# It maps tokens (kept sorted for prefix lookups) and the trigrams of the name words to project IDs. It is rebuilt lazily
+# on the first search after the Project table changes.
+class InvertedIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stale = True
+        self._documents = {}
+        self._name_postings = {}
+        self._description_postings = {}
+        self._vocabulary = []
+        self._trigram_postings = {}
+        self._name_trigrams = {}
+
+    # Marks the index as out of date, so the next search rebuilds it.
+    def invalidate(self):
+        self._stale = True
+
+    # Reads every project (in batches) and rebuilds the index.
+    def build(self, session: Session, batch_size: int = 1000):
+        documents, name_postings, description_postings = {}, {}, {}
+        trigram_postings, name_trigrams = {}, {}
+        statement = select(Project.id, Project.name, Project.description).execution_options(yield_per=batch_size)
+        for project_id, name, description in session.exec(statement):
+            documents[project_id] = (name, description)
+            for token in tokenize(name):
+                name_postings.setdefault(token, set()).add(project_id)
+            for token in tokenize(description):
+                description_postings.setdefault(token, set()).add(project_id)
+            name_trigrams[project_id] = [trigrams(word) for word in tokenize(name)]
+            for word_trigrams in name_trigrams[project_id]:
+                for gram in word_trigrams:
+                    trigram_postings.setdefault(gram, set()).add(project_id)
+        self._documents = documents
+        self._name_postings = name_postings
+        self._description_postings = description_postings
+        self._vocabulary = sorted(set(name_postings) | set(description_postings))
+        self._trigram_postings = trigram_postings
+        self._name_trigrams = name_trigrams
+        self._stale = False
+
+    # Returns the vocabulary tokens starting with prefix.
+    def _expand(self, prefix: str) -> List[str]:
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        end = bisect.bisect_left(self._vocabulary, prefix + "\uffff")
+        return self._vocabulary[start:end]
+
+    # Returns (score, id, name, description) for every project matching q, best matches first.
+    # Scoring follows the Postgres query: token matches (exact > prefix, name > description) plus the similarity of the
+    # query with the best matching word of the name (or the whole name, for queries of several words).
+    def search(self, session: Session, q: str) -> List[Tuple[float, int, str, str]]:
+        with self._lock:
+            if self._stale:
+                self.build(session)
+
+        scores = None
+        for token in tokenize(q):
+            token_scores = {}
+            for word in self._expand(token):
+                weight = 1.0 if word == token else 0.5
+                for project_id in self._name_postings.get(word, ()):
+                    token_scores[project_id] = max(token_scores.get(project_id, 0), 2 * weight)
+                for project_id in self._description_postings.get(word, ()):
+                    token_scores[project_id] = max(token_scores.get(project_id, 0), weight)
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {project_id: score + token_scores[project_id]
+                          for project_id, score in scores.items() if project_id in token_scores}
+        scores = scores or {}
+
+        query_trigrams = trigrams(q)
+        candidates = set()
+        for gram in query_trigrams:
+            candidates.update(self._trigram_postings.get(gram, ()))
+        for project_id in candidates:
+            word_trigrams = self._name_trigrams[project_id]
+            similarity = max(jaccard(query_trigrams, grams) for grams in [*word_trigrams, set().union(*word_trigrams)])
+            if project_id in scores or similarity >= SIMILARITY_THRESHOLD:
+                scores[project_id] = scores.get(project_id, 0) + similarity
+
+        matches = [(score, project_id, *self._documents[project_id]) for project_id, score in scores.items()]
+        matches.sort(key=lambda match: (-match[0], match[1]))
+        return matches
+
+
+# The inverted index used by this worker when the database has no full-text search
+search_index = InvertedIndex()
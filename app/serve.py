@@ -0,0 +1,213 @@
+'''
+Production server: runs the app in several uvicorn worker processes that share one listening socket.
+The master process imports the app and initializes the database schema once, then forks the workers, so they share
+the loaded code copy-on-write and start serving right away. It replaces workers that exit (e.g. after serving
+--max-requests requests, to cap memory growth) and, on SIGTERM or SIGINT, lets every worker finish the requests it is
+handling before it stops. Workers use uvloop and httptools when they are installed.
+
+Each worker has its own caches and rate limit counters unless they are shared through Redis (RESPONSE_CACHE_URL and
+RATE_LIMIT_URL). Without them, a write only invalidates the listing cache of the worker that served it, and every
+worker counts the rate limits on its own, so by default a single worker is started; see per_process_state.
+
+Usage:
+    python -m app.serve [--host 0.0.0.0] [--port 8000] [--workers N] [--max-requests M] [--graceful-timeout 30]
+'''
+
+
+import argparse
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import time
+import uvicorn
+from typing import List
+from app import config  # noqa: F401  (loads the .env file)
+
+
+logger = logging.getLogger("app.serve")
+
+
+# Server settings, read from environment variables; the command line options override them
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+# Number of worker processes; by default one per CPU core available to the process when the caches and rate limits
+# are shared through Redis, and one otherwise
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "0"))
+# A worker is replaced after serving this many requests (plus a random jitter, so workers do not restart together); 0 never
+MAX_REQUESTS = int(os.getenv("MAX_REQUESTS", "10000"))
+MAX_REQUESTS_JITTER = int(os.getenv("MAX_REQUESTS_JITTER", "1000"))
+# Seconds a stopping worker waits for the requests in progress before closing their connections
+GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT", "30"))
+# Comma separated addresses (or networks) of the proxies whose X-Forwarded-* headers are trusted. The client address
+# is the right-most X-Forwarded-For entry that is not one of them, and the rate limits are keyed on it, so list every
+# proxy in front of the app; "*" would let any client pick its address (and its rate limits) with a forged header.
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+
+# A function to count the CPU cores this process may run on (which can be fewer than the machine has, in containers).
+def cpu_count() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# A function to list the state that each worker would keep in its own memory, with the setting that shares it.
+# Users cached by a worker are also only invalidated in that worker: a user changed or deleted through the API keeps
+# its old role on the other workers for up to USER_CACHE_TTL_SECONDS, whatever the configuration.
+def per_process_state() -> List[str]:
+    from app.crud import RESPONSE_CACHE_URL
+    from app.ratelimit import RATE_LIMIT_ENABLED, RATE_LIMIT_URL
+
+    state = []
+    if not RESPONSE_CACHE_URL:
+        state.append("the project listing cache (after a write, the other workers serve stale pages for up to "
+                     "RESPONSE_CACHE_TTL_SECONDS; set RESPONSE_CACHE_URL)")
+    if RATE_LIMIT_ENABLED and not RATE_LIMIT_URL:
+        state.append("the rate limit counters (the limits are multiplied by the number of workers; set RATE_LIMIT_URL)")
+    return state
+
+
+# A function to open the listening socket shared by every worker.
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+# A function to import the app and prepare the database in the master, before the workers are forked.
+# The schema is initialized once here instead of concurrently in every worker, and the connections it used are closed
+# so no worker inherits (and shares) a database connection.
+def preload():
+    from app import database
+    from app.main import app
+
+    database.init_schema()
+    database.SCHEMA_INIT = "skip"
+    if database._engine is not None:
+        database._engine.dispose()
+    return app
+
+
+# A function to build the uvicorn configuration of a worker.
+def worker_config(app, args) -> uvicorn.Config:
+    max_requests = args.max_requests + random.randint(0, args.max_requests_jitter) if args.max_requests else None
+    return uvicorn.Config(
+        app,
+        loop="auto",
+        http="auto",
+        lifespan="on",
+        proxy_headers=True,
+        forwarded_allow_ips=args.forwarded_allow_ips,
+        limit_max_requests=max_requests,
+        timeout_graceful_shutdown=args.graceful_timeout,
+    )
+
+
+# A function to fork a worker process serving the app on sock; it returns the worker PID in the master.
+# uvicorn handles SIGTERM and SIGINT in the worker: it stops accepting connections and finishes the requests
+# in progress (for up to the graceful timeout) before it exits.
+def spawn_worker(app, sock: socket.socket, args) -> int:
+    pid = os.fork()
+    if pid:
+        return pid
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    exit_code = 0
+    try:
+        server = uvicorn.Server(worker_config(app, args))
+        server.run(sockets=[sock])
+        if not server.started:
+            exit_code = 3  # the app failed to start, like uvicorn's own exit code
+    except BaseException:
+        logger.exception("Worker %d crashed", os.getpid())
+        exit_code = 1
+    finally:
+        os._exit(exit_code)
+
+
+# A function to run the master process: start the workers, replace those that exit, and stop them all on SIGTERM/SIGINT.
+# A worker that exits within a second of its start is replaced after a short delay, so a broken app does not make the
+# master fork in a tight loop.
+def run_master(app, sock: socket.socket, args):
+    workers = {}
+    stopping = []
+
+    def stop(signum, frame):
+        if not stopping:
+            logger.info("Received %s, stopping %d workers", signal.Signals(signum).name, len(workers))
+            stopping.append(time.monotonic() + args.graceful_timeout + 5)
+            for worker in workers:
+                try:
+                    os.kill(worker, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(args.workers):
+        workers[spawn_worker(app, sock, args)] = time.monotonic()
+    logger.info("Serving on %s:%d with %d workers", args.host, args.port, args.workers)
+
+    while workers:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            if stopping and time.monotonic() > stopping[0]:
+                logger.warning("Workers did not stop in time, killing them")
+                for worker in workers:
+                    try:
+                        os.kill(worker, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                stopping[0] = float("inf")
+            time.sleep(0.2)
+            continue
+        started = workers.pop(pid, None)
+        if started is None or stopping:
+            continue
+        if time.monotonic() - started < 1:
+            time.sleep(1)
+        logger.info("Worker %d exited (status %d), starting a new one", pid, status >> 8)
+        workers[spawn_worker(app, sock, args)] = time.monotonic()
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY or None)
+    parser.add_argument("--max-requests", type=int, default=MAX_REQUESTS)
+    parser.add_argument("--max-requests-jitter", type=int, default=MAX_REQUESTS_JITTER)
+    parser.add_argument("--graceful-timeout", type=float, default=GRACEFUL_TIMEOUT)
+    parser.add_argument("--forwarded-allow-ips", default=FORWARDED_ALLOW_IPS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s")
+    if args.forwarded_allow_ips.strip() == "*":
+        logger.warning("Trusting X-Forwarded-For from any address: clients can spoof their IP and evade the rate limits")
+    else:
+        logger.info("Trusting X-Forwarded-* headers from %s", args.forwarded_allow_ips)
+    unshared = per_process_state()
+    if args.workers is None:
+        args.workers = 1 if unshared else cpu_count()
+    elif args.workers > 1 and unshared:
+        logger.warning("Running %d workers without sharing %s", args.workers, " and ".join(unshared))
+
+    sock = bind_socket(args.host, args.port)
+    app = preload()
+    if args.workers <= 1 or not hasattr(os, "fork"):
+        # A single process (or a platform without fork): uvicorn serves in this process
+        uvicorn.Server(worker_config(app, args)).run(sockets=[sock])
+        return
+    run_master(app, sock, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
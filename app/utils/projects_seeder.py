@@ -1,59 +1,262 @@
 '''
-This script seeds the database with sample project data.
-It creates a list of sample projects with names and descriptions, and then inserts them into the database.
+This script seeds the database with project data.
+Without arguments, it inserts a list of sample projects with names and descriptions. With --count, it generates that
+many synthetic projects from the samples instead (e.g. for benchmarks), and the import command loads projects from a
+CSV or NDJSON file. Rows are streamed and written in batches, with COPY FROM STDIN on Postgres, so memory use does not
+grow with the input size.
+
+Usage:
+    python -m app.utils.projects_seeder [--count 1000000] [--batch-size 5000]
+    python -m app.utils.projects_seeder import projects.csv [--format csv|ndjson] [--batch-size 5000] [--defer-indexes]
 '''
 
 
+import argparse
+import csv
+import io
+import itertools
+import logging
+import sys
+import time
+import orjson
+from sqlalchemy import delete, insert, select, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.schema import DropIndex
 from sqlmodel import Session
-from app.database import get_engine
-from app.models import Project
+from app.crud import projects_cache, record_project_changes
+from app.database import ensure_indexes, get_engine, init_db, sync_project_id_sequence
+from app.models import Project, ProjectFreeId
+from app.search import SEARCH_INDEXES, ensure_search_indexes
 
 
-# Function to seed the database with sample project data
-def seed_projects():
-    sample_projects = [
-        ("AI-Powered Chatbot",
-         "A virtual assistant that uses natural language processing to help users with FAQs."),
-        ("E-Commerce Store", "An online platform for selling electronics with real-time inventory and payment gateway."),
-        ("Weather Dashboard",
-         "A responsive app showing weather forecasts using public APIs."),
-        ("Task Manager", "A to-do list app with project-based task grouping and due dates."),
-        ("Fitness Tracker",
-         "Mobile-first app that logs workouts, meals, and progress with charts."),
-        ("Budget Planner", "A web app for tracking income, expenses, and financial goals."),
-        ("Portfolio Website", "A personal portfolio site for showcasing work and projects."),
-        ("Blog CMS", "A content management system for creating, editing, and publishing blog posts."),
-        ("Recipe App", "An app to save, share, and discover recipes with ingredient filters."),
-        ("Event Scheduler",
-         "An app to create and manage events with calendar and RSVP system."),
-        ("Crypto Tracker",
-         "Tracks prices of major cryptocurrencies and shows historical trends."),
-        ("Online Quiz System",
-         "A system for creating timed quizzes and auto-grading results."),
-        ("Job Board", "A portal where companies can post jobs and users can apply with resumes."),
-        ("Language Learning App",
-         "An interactive app that helps users learn new languages."),
-        ("News Aggregator", "Fetches and categorizes news headlines from multiple sources."),
-        ("Movie Recommendation Engine",
-         "Suggests movies based on user ratings and genre preferences."),
-        ("Remote Work Dashboard",
-         "Tracks productivity, meetings, and tasks for remote teams."),
-        ("Music Streaming Service", "Streams curated playlists and user-uploaded music."),
-        ("Inventory System",
-         "Manages stock levels, orders, and suppliers for small businesses."),
-        ("Online Voting System",
-         "A secure, anonymous voting platform with user authentication.")
-    ]
+# Sample projects, also used as the templates of synthetic projects
+SAMPLE_PROJECTS = [
+    ("AI-Powered Chatbot",
+     "A virtual assistant that uses natural language processing to help users with FAQs."),
+    ("E-Commerce Store", "An online platform for selling electronics with real-time inventory and payment gateway."),
+    ("Weather Dashboard",
+     "A responsive app showing weather forecasts using public APIs."),
+    ("Task Manager", "A to-do list app with project-based task grouping and due dates."),
+    ("Fitness Tracker",
+     "Mobile-first app that logs workouts, meals, and progress with charts."),
+    ("Budget Planner", "A web app for tracking income, expenses, and financial goals."),
+    ("Portfolio Website", "A personal portfolio site for showcasing work and projects."),
+    ("Blog CMS", "A content management system for creating, editing, and publishing blog posts."),
+    ("Recipe App", "An app to save, share, and discover recipes with ingredient filters."),
+    ("Event Scheduler",
+     "An app to create and manage events with calendar and RSVP system."),
+    ("Crypto Tracker",
+     "Tracks prices of major cryptocurrencies and shows historical trends."),
+    ("Online Quiz System",
+     "A system for creating timed quizzes and auto-grading results."),
+    ("Job Board", "A portal where companies can post jobs and users can apply with resumes."),
+    ("Language Learning App",
+     "An interactive app that helps users learn new languages."),
+    ("News Aggregator", "Fetches and categorizes news headlines from multiple sources."),
+    ("Movie Recommendation Engine",
+     "Suggests movies based on user ratings and genre preferences."),
+    ("Remote Work Dashboard",
+     "Tracks productivity, meetings, and tasks for remote teams."),
+    ("Music Streaming Service", "Streams curated playlists and user-uploaded music."),
+    ("Inventory System",
+     "Manages stock levels, orders, and suppliers for small businesses."),
+    ("Online Voting System",
+     "A secure, anonymous voting platform with user authentication.")
+]
+
+
+# A generator of `count` synthetic projects built from the samples; names get a numeric suffix to stay unique.
+def synthetic_projects(count: int, start: int = 1):
+    templates = itertools.cycle(SAMPLE_PROJECTS)
+    for number in range(start, start + count):
+        name, description = next(templates)
+        yield {"name": f"{name} #{number}", "description": description}
+
+
+# Generators reading projects from a text stream, one row at a time
+def read_csv(stream):
+    yield from csv.DictReader(stream)
+
+
+def read_ndjson(stream):
+    for line in stream:
+        if line.strip():
+            yield orjson.loads(line)
 
+
+READERS = {"csv": read_csv, "ndjson": read_ndjson}
+
+
+# A generator validating the rows read from a file and keeping only the project columns.
+# Either every row has an id or none has (the database assigns them), so each batch has the same columns.
+def clean_rows(rows):
+    with_ids = None
+    for number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            raise ValueError(f"Row {number}: expected an object with name and description")
+        name, description, project_id = row.get("name"), row.get("description"), row.get("id")
+        if not name or description is None:
+            raise ValueError(f"Row {number}: name and description are required")
+        if project_id in ("", None):
+            project_id = None
+        if with_ids is None:
+            with_ids = project_id is not None
+        if with_ids != (project_id is not None):
+            raise ValueError(f"Row {number}: either every row has an id or none has")
+        cleaned = {"name": str(name), "description": str(description)}
+        if with_ids:
+            try:
+                cleaned = {"id": int(project_id), **cleaned}
+            except (TypeError, ValueError):
+                raise ValueError(f"Row {number}: invalid id {project_id!r}")
+        yield cleaned
+
+
+# A function to write one batch with COPY FROM STDIN (psycopg2), encoded as CSV in memory.
+# COPY reads an empty unquoted CSV field as NULL, so the text columns are marked FORCE_NOT_NULL to load an empty
+# description as an empty string.
+def copy_batch(connection, batch):
+    columns = list(batch[0])
+    text_columns = [column for column in columns if column != "id"]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows([row[column] for column in columns] for row in batch)
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY project ({', '.join(columns)}) FROM STDIN "
+                           f"WITH (FORMAT csv, FORCE_NOT_NULL ({', '.join(text_columns)}))", buffer)
+    finally:
+        cursor.close()
+
+
+# Function to write projects to the database in batches, one transaction per batch.
+# It uses COPY on Postgres with psycopg2 and a multi-row executemany insert elsewhere, and prints the progress
+# every `progress_every` rows. It returns the number of rows written.
+def write_projects(rows, batch_size: int = 1000, progress_every: int = 0) -> int:
     engine = get_engine()
-    with Session(engine) as session:
-        for name, description in sample_projects:
-            project = Project(name=name, description=description)
-            session.add(project)
-        session.commit()
-        print("✅ 20 projects added successfully.")
+    use_copy = engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2"
+    started = time.perf_counter()
+    count, explicit_ids = 0, False
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        explicit_ids = "id" in batch[0]
+        with engine.begin() as connection:
+            if count == 0 and not explicit_ids:
+                # Projects created with explicit IDs (gap reuse, earlier imports) may be ahead of the sequence
+                sync_project_id_sequence(connection)
+            if use_copy:
+                copy_batch(connection, batch)
+            else:
+                connection.execute(insert(Project), batch)
+        previous, count = count, count + len(batch)
+        if progress_every and count // progress_every > previous // progress_every:
+            print(f"  {count:,} rows ({count / (time.perf_counter() - started):,.0f} rows/sec)", file=sys.stderr)
+
+    # Rows inserted with explicit IDs do not advance the Postgres sequence, so move it past the highest ID,
+    # and may take IDs freed by deletions, which must not be handed out again.
+    if explicit_ids:
+        with engine.begin() as connection:
+            sync_project_id_sequence(connection)
+            connection.execute(delete(ProjectFreeId).where(ProjectFreeId.id.in_(select(Project.id))))
+
+    # Imported projects are not logged one by one in the change log: a "reload" entry tells its consumers to read the
+    # whole list again.
+    if count:
+        with Session(engine) as session:
+            record_project_changes(session, "reload", [])
+            session.commit()
+
+    # Writes done here bypass the ORM events that invalidate the cached project pages of the API. With a shared cache
+    # (RESPONSE_CACHE_URL) this bumps the generation every API worker reads, so they drop their pages at once; with
+    # the default in-process cache, running workers serve their cached pages until they expire
+    # (RESPONSE_CACHE_TTL_SECONDS). Their in-process search index (used without Postgres) is only rebuilt after their
+    # next write, so restart them after importing into SQLite.
+    projects_cache.invalidate()
+    return count
+
+
+# Functions to drop the secondary indexes of the Project table before a large import and create them again after.
+# Building an index once over all the rows is much faster than updating it on every insert. Unique indexes are kept,
+# since they are what rejects duplicate project names.
+def drop_project_indexes():
+    engine = get_engine()
+    with engine.begin() as connection:
+        for index in Project.__table__.indexes:
+            if not index.unique:
+                connection.execute(DropIndex(index, if_exists=True))
+        if engine.dialect.name == "postgresql":
+            for name in SEARCH_INDEXES:
+                connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def create_project_indexes():
+    engine = get_engine()
+    ensure_indexes(engine)
+    ensure_search_indexes(engine)
+
+
+# Function to seed the database with sample project data
+# Without a count it adds the sample projects; with a count it inserts that many synthetic projects.
+def seed_projects(count: int = None, batch_size: int = 1000):
+    if count is None:
+        count = write_projects({"name": name, "description": description} for name, description in SAMPLE_PROJECTS)
+    else:
+        count = write_projects(synthetic_projects(count), batch_size)
+    print(f"✅ {count} projects added successfully.")
+    return count
+
+
+# Function to import projects from a CSV or NDJSON file ("-" reads from stdin)
+# With defer_indexes, the non-unique secondary indexes (e.g. the search indexes on Postgres) are dropped during
+# the load and rebuilt at the end.
+def import_projects(path: str, file_format: str = None, batch_size: int = 1000, progress_every: int = 100000,
+                    defer_indexes: bool = False) -> int:
+    file_format = file_format or ("ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv")
+    if file_format not in READERS:
+        raise ValueError(f"Unsupported format {file_format!r}, use csv or ndjson")
+
+    started = time.perf_counter()
+    if defer_indexes:
+        drop_project_indexes()
+    stream = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+    try:
+        count = write_projects(clean_rows(READERS[file_format](stream)), batch_size, progress_every)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        if defer_indexes:
+            print("  rebuilding indexes...", file=sys.stderr)
+            create_project_indexes()
+    elapsed = time.perf_counter() - started
+    print(f"✅ {count:,} projects imported in {elapsed:.1f}s ({count / elapsed if elapsed else 0:,.0f} rows/sec).")
+    return count
 
 
 # Function to run the seeder script
 if __name__ == "__main__":
-    seed_projects()
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, help="Number of synthetic projects to generate instead of the samples")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Rows written per transaction")
+    commands = parser.add_subparsers(dest="command")
+    importer = commands.add_parser("import", help="Import projects from a CSV or NDJSON file")
+    importer.add_argument("path", help='File to import, or "-" for stdin')
+    importer.add_argument("--format", choices=sorted(READERS), help="Defaults to the file extension")
+    importer.add_argument("--batch-size", type=int, default=5000, help="Rows written per transaction")
+    importer.add_argument("--progress-every", type=int, default=100000, help="Print the progress every N rows")
+    importer.add_argument("--defer-indexes", action="store_true",
+                          help="Drop the secondary indexes during the import and rebuild them at the end")
+    args = parser.parse_args()
+
+    init_db()
+    if args.command == "import":
+        try:
+            import_projects(args.path, args.format, args.batch_size, args.progress_every, args.defer_indexes)
+        except (OSError, ValueError, SQLAlchemyError, get_engine().dialect.dbapi.Error) as e:
+            sys.exit(f"❌ Import failed: {e}")
+    else:
+        seed_projects(args.count, args.batch_size)
@@ -0,0 +1,109 @@
+'''
+Shared helpers for the benchmark scripts.
+The app modules read their configuration from environment variables at import time,
+so every benchmark calls configure_environment() before importing anything from the app package.
+Results can be written as JSON tagged with the git commit, so runs on different commits can be compared
+with benchmarks.compare.
+'''
+
+
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+
+# A function to set the environment variables the app needs, defaulting to a throwaway SQLite database.
+# Values already present in the environment (e.g. a Postgres URL) are kept.
+def configure_environment(database_url: str = None, **overrides):
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+    os.environ.setdefault("ALGORITHM", "HS256")
+    os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+    # Every benchmark client logs in from the same IP, which the login rate limit would quickly reject
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    if database_url:
+        os.environ["ORACLE_POSTGRES_URL"] = database_url
+    os.environ.setdefault("ORACLE_POSTGRES_URL", "sqlite:///benchmark.sqlite")
+    for key, value in overrides.items():
+        os.environ[key] = str(value)
+
+
+# A function to call fn `iterations` times and return the latencies in milliseconds.
+def measure(fn, iterations: int):
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+# A function to summarize a list of latencies (in milliseconds) as p50/p95/p99.
+def summarize(latencies):
+    ordered = sorted(latencies)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+        "p50_ms": round(percentile(50), 3),
+        "p95_ms": round(percentile(95), 3),
+        "p99_ms": round(percentile(99), 3),
+    }
+
+
+# A function to measure the memory allocated by fn, averaged over `iterations` calls.
+# It reports the peak traced memory of a call (what one request needs) and the number of live blocks it left behind.
+def measure_allocations(fn, iterations: int):
+    fn()  # warm-up, so one-time imports and caches are not counted
+    tracemalloc.start()
+    try:
+        peaks, retained = [], []
+        for _ in range(iterations):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            blocks = len(tracemalloc.take_snapshot().traces)
+            fn()
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+            retained.append(len(tracemalloc.take_snapshot().traces) - blocks)
+    finally:
+        tracemalloc.stop()
+    return {
+        "peak_kib": round(statistics.fmean(peaks) / 1024, 2),
+        "retained_blocks": round(statistics.fmean(retained), 1),
+    }
+
+
+# A function to describe the current run: git commit, interpreter and machine.
+def run_metadata():
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, check=True,
+                                  cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "database": os.environ.get("ORACLE_POSTGRES_URL", "").split(":", 1)[0],
+    }
+
+
+# A function to print benchmark results as JSON and, if path is given, save them along with the run metadata.
+def write_results(benchmark: str, parameters: dict, results: dict, path: str = None):
+    document = {"benchmark": benchmark, **run_metadata(), "parameters": parameters, "results": results}
+    print(json.dumps(document, indent=2))
+    if path:
+        with open(path, "w") as file:
+            json.dump(document, file, indent=2)
+            file.write("\n")
@@ -0,0 +1,61 @@
+'''
+Compares two benchmark result files written with --output (e.g. from two commits).
+For every metric present in both files it prints the baseline value, the candidate value and the change in percent,
+and flags latency or allocation increases (and throughput drops) beyond the threshold as regressions.
+
+Usage:
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 10]
+'''
+
+
+import argparse
+import json
+import sys
+
+
+# Metrics where a higher value is better; for every other metric (latencies, allocations) lower is better.
+HIGHER_IS_BETTER = {"requests_per_second"}
+COMPARED_METRICS = {"p50_ms", "p95_ms", "p99_ms", "requests_per_second", "peak_kib"}
+
+
+# A function to flatten nested results into {"endpoint.metric": value} for the compared metrics.
+def flatten(results: dict, prefix: str = ""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif key in COMPARED_METRICS and isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Change in percent reported as a regression")
+    args = parser.parse_args()
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.candidate) as file:
+        candidate = json.load(file)
+    if baseline.get("benchmark") != candidate.get("benchmark"):
+        parser.error("the files come from different benchmarks")
+
+    print(f"baseline  {(baseline.get('commit') or '?')[:12]}  {baseline.get('timestamp')}")
+    print(f"candidate {(candidate.get('commit') or '?')[:12]}  {candidate.get('timestamp')}")
+    before, after = flatten(baseline["results"]), flatten(candidate["results"])
+    regressions = 0
+    for metric in sorted(before.keys() & after.keys()):
+        old, new = before[metric], after[metric]
+        change = (new - old) / old * 100 if old else 0.0
+        worse = -change if metric.rsplit(".", 1)[-1] in HIGHER_IS_BETTER else change
+        flag = "  REGRESSION" if worse > args.threshold else ""
+        regressions += bool(flag)
+        print(f"{metric:<50} {old:>12.3f} {new:>12.3f} {change:>+8.1f}%{flag}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
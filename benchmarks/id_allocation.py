@@ -0,0 +1,123 @@
+'''
+Benchmark for the project ID allocation done on every POST /projects.
+It seeds a dense Project table (the worst case for gap search) at several sizes, measures the latency of
+the legacy Python gap scan, the lookup of the next free ID and full inserts with both ID strategies (after
+deleting projects spread over the table, so gap reuse has freed IDs to hand out), then runs concurrent inserts
+to check that no request fails on a duplicate primary key.
+
+Usage:
+    python -m benchmarks.id_allocation [--sizes 10000,100000,1000000] [--database-url URL]
+'''
+
+
+import argparse
+import json
+import threading
+from benchmarks.common import configure_environment, measure, summarize
+
+
+# The legacy allocator, kept here as the baseline: it loads every used ID and walks them in Python.
+def legacy_next_available_project_id(session, select, Project):
+    used_ids = session.exec(select(Project.id).order_by(Project.id)).all()
+    current = 1
+    for used_id in used_ids:
+        if used_id != current:
+            return current
+        current += 1
+    return current
+
+
+# A function to reset the Project table and fill it with `size` rows numbered 1..size.
+def seed_dense(engine, Project, size: int, chunk: int = 10000):
+    from sqlalchemy import delete, insert
+    from app.models import ProjectFreeId
+    with engine.begin() as connection:
+        connection.execute(delete(ProjectFreeId))
+        connection.execute(delete(Project))
+        for start in range(1, size + 1, chunk):
+            stop = min(start + chunk, size + 1)
+            connection.execute(insert(Project), [
+                {"id": i, "name": f"seed-{i}", "description": "benchmark row"} for i in range(start, stop)
+            ])
+
+
+# A function to insert projects from several threads at once and count the failed inserts.
+def run_concurrent_inserts(engine, crud, ProjectCreate, Session, threads: int, per_thread: int):
+    from fastapi import HTTPException
+    failures = []
+
+    def worker(worker_id):
+        with Session(engine) as session:
+            for i in range(per_thread):
+                try:
+                    crud.create_project(session, ProjectCreate(
+                        name=f"concurrent-{worker_id}-{i}", description="benchmark row"))
+                except HTTPException as e:
+                    failures.append(e.detail)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--per-thread", type=int, default=25)
+    parser.add_argument("--database-url")
+    args = parser.parse_args()
+
+    configure_environment(args.database_url or "sqlite:///benchmark_ids.sqlite")
+
+    from sqlmodel import Session, select
+    from app import crud
+    from app.database import get_engine, init_db
+    from app.models import Project, ProjectCreate
+
+    engine = get_engine()
+    init_db()
+    configured_strategy = crud.PROJECT_ID_STRATEGY
+
+    for size in [int(value) for value in args.sizes.split(",")]:
+        seed_dense(engine, Project, size)
+        row = {}
+        with Session(engine) as session:
+            # The legacy scan is slow on large tables, so it only gets a few iterations
+            row["legacy_scan"] = summarize(measure(
+                lambda: legacy_next_available_project_id(session, select, Project), max(3, args.iterations // 4)))
+            row["gap_query"] = summarize(measure(
+                lambda: crud.get_next_available_project_id(session), args.iterations))
+
+            for strategy in ("gap", "sequence"):
+                crud.PROJECT_ID_STRATEGY = strategy
+                for project_id in range(1, size + 1, max(1, size // args.iterations))[:args.iterations]:
+                    crud.delete_project(session, project_id)
+                counter = iter(range(args.iterations))
+                row[f"insert_{strategy}"] = summarize(measure(
+                    lambda: crud.create_project(session, ProjectCreate(
+                        name=f"{strategy}-{size}-{next(counter)}", description="benchmark row")),
+                    args.iterations))
+        crud.PROJECT_ID_STRATEGY = configured_strategy
+        print(json.dumps({"size": size, **row}))
+
+    seed_dense(engine, Project, 1000)
+    with Session(engine) as session:
+        for project_id in range(1, 1001, 10):
+            crud.delete_project(session, project_id)
+    failures = run_concurrent_inserts(engine, crud, ProjectCreate, Session, args.threads, args.per_thread)
+    with Session(engine) as session:
+        total = len(session.exec(select(Project.id)).all())
+    expected = 1000 - 100 + args.threads * args.per_thread
+    print(json.dumps({"concurrency": {"strategy": configured_strategy, "threads": args.threads, "inserts": args.threads * args.per_thread,
+                                      "failures": len(failures), "rows": total, "expected_rows": expected}}))
+    if failures or total != expected:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
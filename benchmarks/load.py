@@ -0,0 +1,185 @@
+'''
+Load test for the API hot paths: POST /login, GET /projects and the admin write routes.
+It seeds N synthetic projects, starts the app with uvicorn in a background thread (or targets --base-url),
+then drives each endpoint with concurrent clients and reports p50/p95/p99 latency and throughput.
+Allocations per request are measured in a separate sequential pass inside the process with tracemalloc,
+because tracing slows everything down and would skew the latencies.
+
+Usage:
+    python -m benchmarks.load [--projects 10000] [--concurrency 8] [--requests 200]
+                              [--endpoints login,read_projects,create_project,update_project,delete_project]
+                              [--no-response-cache] [--database-url URL] [--output results.json]
+'''
+
+
+import argparse
+import itertools
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.common import configure_environment, measure_allocations, summarize, write_results
+
+
+ENDPOINTS = ["login", "read_projects", "create_project", "update_project", "delete_project"]
+USERNAME, ADMIN_USERNAME, PASSWORD = "benchmark-user", "benchmark-admin", "benchmark"
+
+
+# A class holding what every scenario needs: the credentials, the tokens and a pool of project IDs
+# that the update and delete scenarios consume.
+class Fixture:
+    def __init__(self, user_token: str, admin_token: str, project_ids):
+        self.user_token = user_token
+        self.admin_token = admin_token
+        self.project_ids = iter(project_ids)
+        self.lock = threading.Lock()
+
+    def next_project_id(self) -> int:
+        with self.lock:
+            return next(self.project_ids)
+
+
+# Functions sending one request of each scenario with an httpx-like client; they fail loudly on unexpected statuses.
+def login(client, fixture):
+    response = client.post("/login", json={"username": USERNAME, "password": PASSWORD})
+    assert response.status_code == 200, response.text
+
+
+def read_projects(client, fixture):
+    response = client.get("/projects", params={"limit": 50}, headers={"Authorization": fixture.user_token})
+    assert response.status_code == 200, response.text
+
+
+def create_project(client, fixture):
+    project = {"name": f"load-{uuid.uuid4().hex}", "description": "load test"}
+    response = client.post("/projects", json=project, headers={"Authorization": fixture.admin_token})
+    assert response.status_code == 200, response.text
+
+
+def update_project(client, fixture):
+    project_id = fixture.next_project_id()
+    project = {"name": f"load-{uuid.uuid4().hex}", "description": "load test, updated"}
+    response = client.put(f"/projects/{project_id}", json=project, headers={"Authorization": fixture.admin_token})
+    assert response.status_code == 200, response.text
+
+
+def delete_project(client, fixture):
+    project_id = fixture.next_project_id()
+    response = client.delete(f"/projects/{project_id}", headers={"Authorization": fixture.admin_token})
+    assert response.status_code == 200, response.text
+
+
+SCENARIOS = {name: globals()[name] for name in ENDPOINTS}
+
+
+# A function to run `requests` calls of a scenario spread over `concurrency` clients.
+# It returns the latency summary and the throughput over the wall-clock time of the run.
+def run_concurrently(scenario, base_url: str, fixture, concurrency: int, requests: int):
+    import httpx
+
+    remaining = itertools.count()
+    latencies, lock = [], threading.Lock()
+
+    def worker():
+        with httpx.Client(base_url=base_url, timeout=60) as client:
+            while next(remaining) < requests:
+                start = time.perf_counter()
+                scenario(client, fixture)
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    wall = time.perf_counter() - started
+    return {**summarize(latencies), "requests_per_second": round(len(latencies) / wall, 1)}
+
+
+# A function to serve the app with uvicorn on a free local port from a background thread.
+# It returns the server, so the caller can stop it by setting should_exit.
+def start_server(app):
+    import uvicorn
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--projects", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint")
+    parser.add_argument("--allocation-requests", type=int, default=20, help="Requests per endpoint traced for allocations")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--no-response-cache", action="store_true", help="Disable the project listing cache")
+    parser.add_argument("--base-url", help="Target an already running server (sharing the same database and secret key)")
+    parser.add_argument("--database-url")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    endpoints = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    unknown = set(endpoints) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    overrides = {"RESPONSE_CACHE_SIZE": 0} if args.no_response_cache else {}
+    configure_environment(args.database_url or "sqlite:///benchmark_load.sqlite", **overrides)
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import delete, func, select
+    from app.database import get_engine
+    from app.main import app
+    from app.models import Project, User
+    from app.utils.projects_seeder import seed_projects
+
+    with TestClient(app) as client:
+        engine = get_engine()
+        with engine.begin() as connection:
+            connection.execute(delete(Project))
+            connection.execute(delete(User).where(User.username.in_([USERNAME, ADMIN_USERNAME])))
+        seed_projects(args.projects)
+        with engine.connect() as connection:
+            first_id = connection.execute(select(func.min(Project.id))).scalar() or 1
+
+        tokens = {}
+        for username, role in ((USERNAME, "user"), (ADMIN_USERNAME, "admin")):
+            client.post("/register", json={"username": username, "password": PASSWORD, "role": role})
+            tokens[role] = client.post("/login", json={"username": username, "password": PASSWORD}).json()["access_token"]
+
+        # Updates walk the seeded IDs from the start and deletes from the end, so both always find a project.
+        def fixture_for(endpoint):
+            if endpoint == "delete_project":
+                ids = range(first_id + args.projects - 1, first_id - 1, -1)
+            else:
+                ids = range(first_id, first_id + args.projects)
+            return Fixture(tokens["user"], tokens["admin"], ids)
+
+        server, base_url = (None, args.base_url) if args.base_url else start_server(app)
+        results = {}
+        try:
+            for endpoint in endpoints:
+                scenario = SCENARIOS[endpoint]
+                fixture = fixture_for(endpoint)
+                run_concurrently(scenario, base_url, fixture, args.concurrency, max(args.concurrency, 10))  # warm-up
+                results[endpoint] = run_concurrently(scenario, base_url, fixture, args.concurrency, args.requests)
+                results[endpoint]["allocations"] = measure_allocations(
+                    lambda: scenario(client, fixture), args.allocation_requests)
+        finally:
+            if server is not None:
+                server.should_exit = True
+
+    parameters = {key: value for key, value in vars(args).items() if key not in ("output", "database_url")}
+    write_results("load", parameters, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
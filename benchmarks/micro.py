@@ -0,0 +1,86 @@
+'''
+Micro-benchmarks of the functions on the API hot paths:
+auth.decode_token (with the verified-token cache on and off), auth.verify_password,
+crud.get_next_available_project_id and the serialization of GET /projects pages.
+Each one reports p50/p95/p99 latency and the memory allocated per call.
+
+Usage:
+    python -m benchmarks.micro [--projects 10000] [--iterations 2000] [--database-url URL] [--output results.json]
+'''
+
+
+import argparse
+import json
+import orjson
+from benchmarks.common import configure_environment, measure, measure_allocations, summarize, write_results
+
+
+# A function to benchmark fn and return its latency summary together with its allocations.
+def profile(fn, iterations: int, allocation_iterations: int = 50):
+    fn()  # warm-up
+    return {**summarize(measure(fn, iterations)),
+            "allocations": measure_allocations(fn, min(iterations, allocation_iterations))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--projects", type=int, default=10000)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--password-iterations", type=int, default=20, help="bcrypt is slow on purpose")
+    parser.add_argument("--page-sizes", default="50,500")
+    parser.add_argument("--database-url")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    configure_environment(args.database_url or "sqlite:///benchmark_micro.sqlite")
+
+    from fastapi.encoders import jsonable_encoder
+    from sqlalchemy import delete
+    from sqlmodel import Session, select
+    from app import auth
+    from app.crud import get_next_available_project_id, get_projects
+    from app.database import get_engine, init_db
+    from app.models import Project
+    from app.utils.projects_seeder import seed_projects
+
+    init_db()
+    engine = get_engine()
+    with engine.begin() as connection:
+        connection.execute(delete(Project))
+    seed_projects(args.projects)
+
+    results = {}
+    token = auth.create_access_token({"sub": "1", "role": "user"})
+    configured_size = auth.token_cache.maxsize
+    for label, size in (("cache_on", configured_size or 4096), ("cache_off", 0)):
+        auth.token_cache.clear()
+        auth.token_cache.maxsize = size
+        results[f"decode_token_{label}"] = profile(lambda: auth.decode_token(token), args.iterations)
+    auth.token_cache.maxsize = configured_size
+
+    hashed = auth.hash_password("benchmark")
+    results["verify_password"] = profile(
+        lambda: auth.verify_password("benchmark", hashed), args.password_iterations, args.password_iterations)
+    results["verify_password"]["bcrypt_rounds"] = auth.BCRYPT_ROUNDS
+
+    with Session(engine) as session:
+        results["get_next_available_project_id"] = profile(
+            lambda: get_next_available_project_id(session), args.iterations)
+
+        # Serialization of list responses: the JSON encoding GET /projects does on a page it already loaded,
+        # compared with FastAPI's default encoding of the same page returned as Project models.
+        for size in (int(value) for value in args.page_sizes.split(",")):
+            page = get_projects(session, limit=size)
+            models = session.exec(select(Project).limit(size)).all()
+            results[f"serialize_page_{size}"] = profile(lambda: orjson.dumps(page), args.iterations)
+            results[f"serialize_models_{size}"] = profile(
+                lambda: json.dumps(jsonable_encoder(models)).encode(), args.iterations)
+            results[f"get_projects_{size}"] = profile(
+                lambda: orjson.dumps(get_projects(session, limit=size)), args.iterations)
+
+    parameters = {key: value for key, value in vars(args).items() if key not in ("output", "database_url")}
+    write_results("micro", parameters, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+'''
+Benchmark of the JSON serialization of project lists, comparing the way FastAPI encodes a list of Project
+instances with the row tuple + orjson path used by the list endpoints.
+For 1k/10k/100k rows it measures, end to end (query + encoding) and for the encoding alone:
+- orm_jsonable_encoder: Project instances through jsonable_encoder and the standard json module
+  (what FastAPI does when a route returns the ORM objects);
+- orm_response_model: Project instances validated and dumped by Pydantic, then the standard json module
+  (what FastAPI does with response_model=List[Project]);
+- rows_json: row tuples turned into dicts and encoded with the standard json module;
+- rows_orjson: row tuples turned into dicts and encoded with orjson (the current path).
+
+Usage:
+    python -m benchmarks.serialization [--sizes 1000,10000,100000] [--iterations 5] [--database-url URL] [--output results.json]
+'''
+
+
+import argparse
+import json
+from benchmarks.common import configure_environment, measure, summarize, write_results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--database-url")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    configure_environment(args.database_url or "sqlite:///benchmark_serialization.sqlite")
+
+    from typing import List
+    import orjson
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+    from sqlalchemy import delete
+    from sqlmodel import Session, select
+    from app.crud import PROJECT_FIELDS
+    from app.database import get_engine, init_db
+    from app.models import Project
+    from app.utils.projects_seeder import seed_projects
+
+    adapter = TypeAdapter(List[Project])
+    encoders = {
+        "orm_jsonable_encoder": lambda projects: json.dumps(jsonable_encoder(projects)).encode(),
+        "orm_response_model": lambda projects: json.dumps(
+            adapter.dump_python(adapter.validate_python(projects, from_attributes=True), mode="json")).encode(),
+        "rows_json": lambda rows: json.dumps([dict(zip(PROJECT_FIELDS, row)) for row in rows]).encode(),
+        "rows_orjson": lambda rows: orjson.dumps([dict(zip(PROJECT_FIELDS, row)) for row in rows]),
+    }
+
+    init_db()
+    engine = get_engine()
+    results = {}
+    for size in (int(value) for value in args.sizes.split(",")):
+        with engine.begin() as connection:
+            connection.execute(delete(Project))
+        seed_projects(size, batch_size=10000)
+
+        with Session(engine) as session:
+            def load(path):
+                if path.startswith("orm_"):
+                    projects = session.exec(select(Project).order_by(Project.id)).all()
+                    session.expunge_all()
+                    return projects
+                return session.exec(select(Project.id, Project.name, Project.description).order_by(Project.id)).all()
+
+            results[size] = {}
+            for path, encode in encoders.items():
+                data = load(path)
+                body = encode(data)
+                results[size][path] = {
+                    "end_to_end": summarize(measure(lambda: encode(load(path)), args.iterations)),
+                    "encode_only": summarize(measure(lambda: encode(data), args.iterations)),
+                    "body_bytes": len(body),
+                }
+            baseline = results[size]["orm_jsonable_encoder"]["end_to_end"]["p50_ms"]
+            results[size]["speedup_p50"] = round(baseline / results[size]["rows_orjson"]["end_to_end"]["p50_ms"], 2)
+
+    parameters = {key: value for key, value in vars(args).items() if key not in ("output", "database_url")}
+    write_results("serialization", parameters, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
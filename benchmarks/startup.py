@@ -0,0 +1,77 @@
+'''
+Benchmark of the application cold start, as seen by an autoscaled replica.
+Each run starts a fresh Python process that imports app.main, runs the startup (lifespan) and serves GET /.
+It reports the import time, the startup time and the total time until the first response (including the
+interpreter start), as the median over several runs. With --budget-ms it exits with status 1 when the median time
+to the first response is over budget, so it can gate a CI job.
+
+The startup mode is taken from the environment, e.g. SCHEMA_INIT=skip python -m benchmarks.startup
+
+Usage:
+    python -m benchmarks.startup [--runs 5] [--budget-ms 1500] [--database-url URL] [--output results.json]
+'''
+
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from benchmarks.common import configure_environment, write_results
+
+
+# The script run by every child process; it prints its own timings as JSON.
+CHILD = """
+import json, time
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app.main.app) as client:
+    ready = time.perf_counter()
+    assert client.get("/").status_code == 200
+    served = time.perf_counter()
+print(json.dumps({"import_ms": (imported - started) * 1000, "startup_ms": (ready - imported) * 1000,
+                  "first_request_ms": (served - ready) * 1000}))
+"""
+
+
+# A function to start one child process and return its timings, plus the wall time until its first response.
+def run_once(root: str) -> dict:
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", CHILD], cwd=root, capture_output=True, text=True,
+                            env={**os.environ, "PYTHONPATH": root})
+    finished = time.perf_counter()
+    if result.returncode != 0:
+        raise RuntimeError(f"the app failed to start:\n{result.stderr}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["process_ms"] = (finished - started) * 1000
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, help="Fail when the median time to the first response is higher")
+    parser.add_argument("--database-url")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    configure_environment(args.database_url or "sqlite:///benchmark_startup.sqlite")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    run_once(root)  # warm-up: fills the OS file cache and the bytecode cache, and creates the schema
+    runs = [run_once(root) for _ in range(args.runs)]
+    results = {key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]}
+    results["schema_init"] = os.environ.get("SCHEMA_INIT", "auto")
+
+    parameters = {key: value for key, value in vars(args).items() if key not in ("output", "database_url")}
+    write_results("startup", parameters, results, args.output)
+    if args.budget_ms is not None and results["process_ms"] > args.budget_ms:
+        sys.exit(f"Startup over budget: {results['process_ms']} ms > {args.budget_ms} ms")
+
+
+if __name__ == "__main__":
+    main()
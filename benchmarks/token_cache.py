@@ -0,0 +1,73 @@
+'''
+Benchmark for the verified-token cache used by auth.decode_token.
+It logs in once and sends the same bearer token to GET /projects for a fixed duration,
+first with the token cache enabled and then with it disabled, and reports requests/sec for both runs
+along with the cost of a single decode_token call.
+
+Usage:
+    python -m benchmarks.token_cache [--projects 100] [--duration 5] [--database-url URL]
+'''
+
+
+import argparse
+import json
+import time
+from benchmarks.common import configure_environment, measure, summarize
+
+
+# A function to send GET /projects requests with the given token for `duration` seconds and return requests/sec.
+def requests_per_second(client, token: str, duration: float) -> float:
+    headers = {"Authorization": token}
+    count = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        response = client.get("/projects", headers=headers)
+        assert response.status_code == 200, response.text
+        count += 1
+    return count / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--projects", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--database-url")
+    args = parser.parse_args()
+
+    configure_environment(args.database_url or "sqlite:///benchmark_tokens.sqlite")
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import delete, insert
+    from app import auth
+    from app.database import get_engine
+    from app.main import app
+    from app.models import Project, User
+
+    engine = get_engine()
+    with TestClient(app) as client:
+        with engine.begin() as connection:
+            connection.execute(delete(Project))
+            connection.execute(delete(User).where(User.username == "benchmark-user"))
+            connection.execute(insert(Project), [
+                {"id": i, "name": f"project-{i}", "description": "benchmark row"} for i in range(1, args.projects + 1)
+            ])
+        client.post("/register", json={"username": "benchmark-user", "password": "benchmark", "role": "user"})
+        token = client.post("/login", json={"username": "benchmark-user", "password": "benchmark"}).json()["access_token"]
+
+        configured_size = auth.token_cache.maxsize
+        results, decode = {}, {}
+        for label, size in (("cache_on", configured_size or 4096), ("cache_off", 0)):
+            auth.token_cache.clear()
+            auth.token_cache.maxsize = size
+            requests_per_second(client, token, 0.5)  # warm-up
+            results[label] = round(requests_per_second(client, token, args.duration), 1)
+            decode[label] = summarize(measure(lambda: auth.decode_token(token), 10000))
+        auth.token_cache.maxsize = configured_size
+
+    results["speedup"] = round(results["cache_on"] / results["cache_off"], 3)
+    print(json.dumps({"endpoint": "GET /projects", "requests_per_second": results}))
+    print(json.dumps({"decode_token": decode}))
+
+
+if __name__ == "__main__":
+    main()
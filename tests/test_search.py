@@ -0,0 +1,61 @@
+'''
+Tests of the project search pagination.
+They run against a temporary SQLite database (the in-process index), or against the database in TEST_DATABASE_URL
+(e.g. a Postgres database, to exercise the full-text query).
+
+'''
+
+import os
+import tempfile
+
+os.environ["ORACLE_POSTGRES_URL"] = os.getenv("TEST_DATABASE_URL") or (
+    "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.sqlite"))
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+
+import pytest
+from sqlalchemy import delete
+from sqlmodel import Session
+from app import crud
+from app.database import get_engine, init_db
+from app.models import Project
+from app.search import search_index
+
+
+TIED_PROJECTS = 25
+
+
+# A fixture creating projects that all get the same search score for "tiebreak"
+@pytest.fixture
+def tied_projects():
+    init_db()
+    with Session(get_engine()) as session:
+        session.exec(delete(Project).where(Project.name.like("Tiebreak Chat %")))
+        projects = [Project(name=f"Tiebreak Chat {i:02d}", description="Same description")
+                    for i in range(TIED_PROJECTS)]
+        session.add_all(projects)
+        session.commit()
+        ids = sorted(project.id for project in projects)
+    search_index.invalidate()
+    yield ids
+    with Session(get_engine()) as session:
+        session.exec(delete(Project).where(Project.id.in_(ids)))
+        session.commit()
+    search_index.invalidate()
+
+
+# Paging through more tied rows than the page size must return every project exactly once, in ID order
+@pytest.mark.parametrize("limit", [1, 7, 10])
+def test_search_pages_through_tied_scores(tied_projects, limit):
+    seen, cursor = [], None
+    with Session(get_engine()) as session:
+        while True:
+            page = crud.search_projects(session, "tiebreak", limit=limit, cursor=cursor)
+            assert len(page["projects"]) <= limit
+            assert len({project["score"] for project in page["projects"]}) <= 1
+            seen.extend(project["id"] for project in page["projects"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+    assert seen == tied_projects